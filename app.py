@@ -7,9 +7,18 @@ import streamlit as st
 import os
 import sys
 import json
+import hashlib
 import time
+import threading
 from pathlib import Path
 
+try:
+    import tiktoken
+    _CL100K = tiktoken.get_encoding("cl100k_base")  # Built once per process
+except Exception:
+    # Not installed, or the BPE file couldn't be downloaded: fall back to the ~4 chars/token estimate
+    _CL100K = None
+
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent / 'src'))
 
@@ -18,6 +27,7 @@ from vector_store import VectorStore
 from utils import format_source_citation, get_confidence_badge, save_conversation_history, load_conversation_history
 from analytics import Analytics
 from query_suggestions import QuerySuggestions
+from semantic_cache import SemanticCache
 
 # Page configuration
 st.set_page_config(
@@ -27,203 +37,32 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+@st.cache_data(show_spinner=False)
+def _css() -> str:
+    """Read the custom stylesheet once per process"""
+    css = (Path(__file__).parent / 'assets' / 'styles.css').read_text(encoding='utf-8')
+    return f"<style>\n{css}</style>"
+
+
 # Custom CSS for better UI
-st.markdown("""
-    <style>
-    /* Main Header */
-    .main-header {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #FC6D26;
-        text-align: center;
-        margin-bottom: 0.5rem;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.1);
-    }
-    .sub-header {
-        text-align: center;
-        color: #666;
-        margin-bottom: 2rem;
-        font-size: 1.1rem;
-    }
-    
-    /* Chat Messages */
-    .chat-message {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin-bottom: 1rem;
-    }
-    .user-message {
-        background-color: #E8F4F8;
-        border-left: 4px solid #FC6D26;
-    }
-    .assistant-message {
-        background-color: #F5F5F5;
-        border-left: 4px solid #4CAF50;
-    }
-    
-    /* Links */
-    .source-link {
-        color: #FC6D26;
-        text-decoration: none;
-        font-weight: 500;
-    }
-    .source-link:hover {
-        text-decoration: underline;
-        color: #E55A1A;
-    }
-    
-    /* Buttons */
-    .stButton>button {
-        width: 100%;
-        background-color: #FC6D26;
-        color: white;
-        border-radius: 0.5rem;
-        border: none;
-        padding: 0.5rem 1rem;
-        font-weight: 500;
-        transition: all 0.3s ease;
-    }
-    .stButton>button:hover {
-        background-color: #E55A1A;
-        transform: translateY(-2px);
-        box-shadow: 0 4px 8px rgba(252, 109, 38, 0.3);
-    }
-    
-    /* Sidebar */
-    [data-testid="stSidebar"] {
-        background: linear-gradient(180deg, #f8f9fa 0%, #ffffff 100%);
-    }
-    
-    /* Metrics */
-    [data-testid="stMetricValue"] {
-        font-size: 1.8rem;
-        color: #FC6D26;
-    }
-    
-    /* Expanders */
-    .streamlit-expanderHeader {
-        font-weight: 600;
-        color: #333;
-    }
-    
-    /* Confidence Badges */
-    .confidence-high {
-        color: #4CAF50;
-        font-weight: 600;
-    }
-    .confidence-medium {
-        color: #FF9800;
-        font-weight: 600;
-    }
-    .confidence-low {
-        color: #F44336;
-        font-weight: 600;
-    }
-    
-    /* Status Indicators */
-    .status-ready {
-        padding: 0.5rem;
-        background-color: #E8F5E9;
-        border-radius: 0.5rem;
-        border-left: 4px solid #4CAF50;
-    }
-    .status-warning {
-        padding: 0.5rem;
-        background-color: #FFF3E0;
-        border-radius: 0.5rem;
-        border-left: 4px solid #FF9800;
-    }
-    
-    /* Scrollbar */
-    ::-webkit-scrollbar {
-        width: 8px;
-    }
-    ::-webkit-scrollbar-track {
-        background: #f1f1f1;
-    }
-    ::-webkit-scrollbar-thumb {
-        background: #FC6D26;
-        border-radius: 4px;
-    }
-    ::-webkit-scrollbar-thumb:hover {
-        background: #E55A1A;
-    }
-    
-    /* Empty State */
-    .empty-state {
-        text-align: center;
-        padding: 3rem 2rem;
-        color: #666;
-    }
-    .example-question {
-        background: #f8f9fa;
-        border: 1px solid #e0e0e0;
-        border-radius: 0.5rem;
-        padding: 0.75rem 1rem;
-        margin: 0.5rem 0;
-        cursor: pointer;
-        transition: all 0.2s ease;
-        text-align: left;
-    }
-    .example-question:hover {
-        background: #E8F4F8;
-        border-color: #FC6D26;
-        transform: translateX(5px);
-    }
-    
-    /* Feedback Buttons */
-    .feedback-container {
-        display: flex;
-        gap: 0.5rem;
-        margin-top: 0.5rem;
-        align-items: center;
-    }
-    .feedback-btn {
-        background: #f0f0f0;
-        border: 1px solid #ddd;
-        border-radius: 0.5rem;
-        padding: 0.25rem 0.75rem;
-        cursor: pointer;
-        transition: all 0.2s ease;
-    }
-    .feedback-btn:hover {
-        background: #e0e0e0;
-    }
-    .feedback-btn.active {
-        background: #4CAF50;
-        color: white;
-        border-color: #4CAF50;
-    }
-    .feedback-btn.active.negative {
-        background: #F44336;
-        border-color: #F44336;
-    }
-    
-    /* Performance Indicator */
-    .performance-badge {
-        display: inline-block;
-        background: #E8F5E9;
-        color: #2E7D32;
-        padding: 0.25rem 0.5rem;
-        border-radius: 0.25rem;
-        font-size: 0.75rem;
-        font-weight: 500;
-        margin-left: 0.5rem;
-    }
-    </style>
-""", unsafe_allow_html=True)
+st.markdown(_css(), unsafe_allow_html=True)
+
+# Number of chat messages rendered per page of history
+MESSAGES_PAGE_SIZE = 20
+
+# Uploaded PDFs contribute at most this many tokens of context
+PDF_CONTEXT_TOKENS = 1000
+# Stop extracting PDF pages once this much text is collected (well above PDF_CONTEXT_TOKENS)
+PDF_EXTRACT_CHARS = PDF_CONTEXT_TOKENS * 8
 
 # Initialize session state
 if 'chatbot' not in st.session_state:
     st.session_state.chatbot = None
-if 'vector_store' not in st.session_state:
-    st.session_state.vector_store = None
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 if 'initialized' not in st.session_state:
     st.session_state.initialized = False
-if 'analytics' not in st.session_state:
-    st.session_state.analytics = None
 if 'show_analytics' not in st.session_state:
     st.session_state.show_analytics = False
 if 'dark_mode' not in st.session_state:
@@ -234,32 +73,177 @@ if 'uploaded_pdf_text' not in st.session_state:
     st.session_state.uploaded_pdf_text = None
 if 'uploaded_pdf_name' not in st.session_state:
     st.session_state.uploaded_pdf_name = None
+if 'uploaded_pdf_context' not in st.session_state:
+    st.session_state.uploaded_pdf_context = None
+if 'uploaded_pdf_pages' not in st.session_state:
+    st.session_state.uploaded_pdf_pages = 0
+if 'pdf_hash' not in st.session_state:
+    st.session_state.pdf_hash = None
+if 'visible_msgs' not in st.session_state:
+    st.session_state.visible_msgs = MESSAGES_PAGE_SIZE
+
+
+@st.cache_resource(show_spinner=False)
+def get_vector_store() -> VectorStore:
+    """Build the vector store once per process and share it across sessions"""
+    vector_store = VectorStore()
+    vector_store.initialize()
+    return vector_store
+
+
+@st.cache_resource(show_spinner=False)
+def get_analytics() -> Analytics:
+    """Shared analytics tracker (one per process)"""
+    return Analytics()
+
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache() -> SemanticCache:
+    """Shared cache of answers for repeated / near-duplicate questions"""
+    return SemanticCache(get_vector_store().embed, threshold=0.95, max_size=256, ttl=3600)
+
+
+@st.cache_resource(show_spinner=False)
+def start_background_warmup() -> threading.Thread:
+    """Build the vector store and warm the index in a daemon thread (once per process)"""
+    def warm():
+        try:
+            # get_vector_store() is idempotent; the request thread simply waits on this build
+            vector_store = get_vector_store()
+            vector_store.batch_search(QuerySuggestions.get_suggestions(20), n_results=5)
+        except Exception as e:
+            print(f"Background warmup failed: {str(e)}")
+    
+    thread = threading.Thread(target=warm, daemon=True)
+    thread.start()
+    return thread
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_suggestions(n: int) -> list[str]:
+    """Query suggestions, rotated every 5 minutes instead of on every rerun"""
+    return QuerySuggestions.get_suggestions(n)
+
+
+@st.cache_data(show_spinner=False)
+def extract_pdf_text(file_bytes: bytes, max_chars: int = PDF_EXTRACT_CHARS) -> tuple[str, int]:
+    """
+    Extract text from a PDF (cached on file contents). Returns (text, page_count)
+    
+    Pages are decoded one at a time and extraction stops after max_chars,
+    since anything past the token limit is truncated away anyway.
+    """
+    import PyPDF2
+    import io
+    
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_bytes))
+    parts = []
+    total_chars = 0
+    for page in pdf_reader.pages:
+        text = page.extract_text() or ""
+        parts.append(text)
+        total_chars += len(text)
+        if total_chars > max_chars:
+            break
+    return "\n".join(parts), len(pdf_reader.pages)
+
+
+@st.cache_data(show_spinner=False)
+def truncate_to_tokens(text: str, max_tokens: int = PDF_CONTEXT_TOKENS) -> str:
+    """Limit text to max_tokens (cl100k_base) so it doesn't overwhelm the prompt"""
+    if _CL100K is None:
+        # tiktoken not installed: approximate ~4 characters per token
+        if len(text) > max_tokens * 4:
+            text = text[:max_tokens * 4] + "\n\n[PDF content truncated for length...]"
+        return text
+    
+    tokens = _CL100K.encode(text)
+    if len(tokens) > max_tokens:
+        text = _CL100K.decode(tokens[:max_tokens])
+        text += "\n\n[PDF content truncated for length...]"
+    return text
+
+
+def render_context_preview(context_preview: list[dict], key: str):
+    """Transparency panel, only built when the user switches it on"""
+    if st.toggle("🔍 Show context preview", key=key, value=False):
+        st.caption("These are the sources being used to answer your question:")
+        for ctx in context_preview:
+            st.markdown(f"**{ctx['section_title']}**")
+            st.markdown(f"🔗 [{ctx['url']}]({ctx['url']})")
+            st.markdown(f"*{ctx['preview']}*")
+            st.divider()
+
+
+def render_message_details(message: dict, idx: int, expand_sources: bool = False):
+    """Sources, confidence, context preview and feedback for a chat message
+
+    Shared by the chat history and the live response so each message is drawn one way
+    """
+    # Show sources if available
+    if "sources" in message and message["sources"]:
+        with st.expander("📚 Sources", expanded=expand_sources):
+            for source in message["sources"]:
+                st.markdown(f"- {format_source_citation(source)}")
+    
+    # Show confidence and performance if available
+    if "confidence" in message:
+        confidence_badge = get_confidence_badge(message['confidence'])
+        performance_info = ""
+        if "response_time" in message:
+            performance_info = f'<span class="performance-badge">⚡ {message["response_time"]:.2f}s</span>'
+        st.caption(f"Confidence: {confidence_badge}{performance_info}", unsafe_allow_html=True)
+    
+    # Context preview (transparency feature)
+    if message.get("context_preview"):
+        render_context_preview(message["context_preview"], key=f"ctx_{idx}")
+    
+    # Feedback buttons for assistant messages (Product Thinking: Feedback Loop)
+    if message["role"] == "assistant" and idx > 0:
+        # Single native widget: 1 = 👍, 0 = 👎, None = no feedback
+        feedback = st.feedback("thumbs", key=f"feedback_{idx}")
+        if feedback != st.session_state.feedback_data.get(idx):
+            st.session_state.feedback_data[idx] = feedback
+            if feedback == 1:
+                st.success("Thanks for your feedback!")
+            elif feedback == 0:
+                st.info("Thanks! We'll use this to improve.")
+
+
+# Start loading the embedding model + index while the page renders
+start_background_warmup()
+
+
+def queue_example_question():
+    """Pills callback: queue the picked example question and clear the selection (pills keep their value)"""
+    st.session_state.pending_query = st.session_state.example_question
+    st.session_state.example_question = None
 
 
 def initialize_system():
     """Initialize chatbot and vector store"""
     try:
-        # Initialize vector store
-        if st.session_state.vector_store is None:
-            st.session_state.vector_store = VectorStore()
-            st.session_state.vector_store.initialize()
-        
-        # Initialize chatbot
+        # Shared vector store (embedding model + index loaded once per process)
+        vector_store = get_vector_store()
+
+        # Initialize chatbot (per session, holds this user's conversation history)
         if st.session_state.chatbot is None:
-            st.session_state.chatbot = Chatbot(st.session_state.vector_store)
-        
-        # Initialize analytics
-        if st.session_state.analytics is None:
-            st.session_state.analytics = Analytics()
-        
+            st.session_state.chatbot = Chatbot(vector_store)
+
+        # Shared analytics; the shared resources are looked up on each use rather than kept in
+        # session state, so a re-initialize in any session switches every session over
+        get_analytics()
+
         st.session_state.initialized = True
         return True
     except Exception as e:
-        st.error(f"Initialization error: {str(e)}")
-        st.info("Please make sure you have:")
-        st.info("1. Set GEMINI_API_KEY in your .env file")
-        st.info("2. Run scraper.py to collect data")
-        st.info("3. Installed all dependencies")
+        st.error(
+            f"❌ **Initialization failed:** {str(e)}\n\n"
+            "**Troubleshooting:**\n"
+            "1. Make sure you have set `GEMINI_API_KEY` in your `.env` file\n"
+            "2. Ensure `data/gitlab_chunks.jsonl` (or `data/gitlab_chunks.json`) exists (run `python src/scraper.py` if needed)\n"
+            "3. Check that all dependencies are installed"
+        )
         return False
 
 
@@ -269,9 +253,12 @@ with st.sidebar:
     
     # Re-initialize button (for manual refresh if needed)
     if st.button("🔄 Re-initialize System", use_container_width=True):
+        # Persist buffered analytics and release the query log before dropping the shared instance
+        if st.session_state.initialized:
+            get_analytics().close()
+        st.cache_resource.clear()
         st.session_state.initialized = False
         st.session_state.chatbot = None
-        st.session_state.vector_store = None
         st.rerun()  # Will trigger auto-initialization
     
     st.divider()
@@ -279,12 +266,11 @@ with st.sidebar:
     # System status
     if st.session_state.initialized:
         st.markdown('<div class="status-ready">✅ <strong>System Ready</strong></div>', unsafe_allow_html=True)
-        if st.session_state.vector_store:
-            try:
-                stats = st.session_state.vector_store.get_stats()
-                st.metric("📊 Total Chunks", f"{stats['total_chunks']:,}")
-            except Exception as e:
-                st.error(f"Error getting stats: {str(e)}")
+        try:
+            stats = get_vector_store().get_stats()
+            st.metric("📊 Total Chunks", f"{stats['total_chunks']:,}")
+        except Exception as e:
+            st.error(f"Error getting stats: {str(e)}")
     else:
         st.markdown('<div class="status-warning">⚠️ <strong>System Not Initialized</strong></div>', unsafe_allow_html=True)
         st.info("Click 'Initialize System' to start")
@@ -295,20 +281,30 @@ with st.sidebar:
     st.subheader("💬 Conversation")
     if st.button("🗑️ Clear History", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.visible_msgs = MESSAGES_PAGE_SIZE
+        st.session_state.pop('pending_export', None)  # Don't offer the cleared conversation for download
         if st.session_state.chatbot:
             st.session_state.chatbot.clear_history()
         st.rerun()
     
-    # Export conversation
+    # Export conversation (serialized only on request, not on every rerun)
     if st.session_state.messages:
-        conversation_json = json.dumps(st.session_state.messages, indent=2)
-        st.download_button(
-            label="📥 Export Conversation",
-            data=conversation_json,
-            file_name="conversation.json",
-            mime="application/json",
-            use_container_width=True
-        )
+        pending_export = st.session_state.get('pending_export')
+        if pending_export is None or pending_export[0] != len(st.session_state.messages):
+            if st.button("📦 Prepare Export", use_container_width=True):
+                st.session_state.pending_export = (
+                    len(st.session_state.messages),
+                    json.dumps(st.session_state.messages, indent=2)
+                )
+                st.rerun()
+        else:
+            st.download_button(
+                label="📥 Export Conversation",
+                data=pending_export[1],
+                file_name="conversation.json",
+                mime="application/json",
+                use_container_width=True
+            )
     
     st.divider()
     
@@ -323,39 +319,52 @@ with st.sidebar:
         help="Upload a PDF to provide additional context. This is optional."
     )
     
-    if uploaded_file is not None:
+    # getvalue() doesn't consume the buffer; only process when the file actually changes
+    file_bytes = uploaded_file.getvalue() if uploaded_file is not None else None
+    file_hash = hashlib.md5(file_bytes).hexdigest() if file_bytes is not None else None
+    if file_hash is not None and file_hash != st.session_state.pdf_hash:
+        st.session_state.pdf_hash = file_hash
         # Process PDF
         try:
-            import PyPDF2
-            import io
-            
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(uploaded_file.read()))
-            pdf_text = ""
-            for page in pdf_reader.pages:
-                pdf_text += page.extract_text() + "\n"
+            pdf_text, page_count = extract_pdf_text(file_bytes)
             
             if pdf_text.strip():
                 st.session_state.uploaded_pdf_text = pdf_text
                 st.session_state.uploaded_pdf_name = uploaded_file.name
-                st.success(f"✅ PDF loaded: **{uploaded_file.name}** ({len(pdf_reader.pages)} pages)")
+                # Truncate once at upload time so queries just reuse the prompt-ready text
+                st.session_state.uploaded_pdf_context = truncate_to_tokens(pdf_text)
+                st.session_state.uploaded_pdf_pages = page_count
             else:
                 st.warning("⚠️ Could not extract text from PDF. Please try another file.")
                 st.session_state.uploaded_pdf_text = None
                 st.session_state.uploaded_pdf_name = None
+                st.session_state.uploaded_pdf_context = None
         except ImportError:
             st.error("❌ PyPDF2 library not installed. Please install it: `pip install PyPDF2`")
             st.session_state.uploaded_pdf_text = None
             st.session_state.uploaded_pdf_name = None
+            st.session_state.uploaded_pdf_context = None
         except Exception as e:
             st.error(f"❌ Error reading PDF: {str(e)}")
             st.session_state.uploaded_pdf_text = None
             st.session_state.uploaded_pdf_name = None
+            st.session_state.uploaded_pdf_context = None
+    elif uploaded_file is None and st.session_state.pdf_hash is not None:
+        # File removed from the uploader: drop its context and let the same file be uploaded again
+        st.session_state.pdf_hash = None
+        st.session_state.uploaded_pdf_text = None
+        st.session_state.uploaded_pdf_name = None
+        st.session_state.uploaded_pdf_context = None
+    
+    if st.session_state.uploaded_pdf_text:
+        st.success(f"✅ PDF loaded: **{st.session_state.uploaded_pdf_name}** ({st.session_state.uploaded_pdf_pages} pages)")
     
     # Clear PDF button
     if st.session_state.uploaded_pdf_text:
         if st.button("🗑️ Clear PDF", key="clear_pdf", use_container_width=True):
             st.session_state.uploaded_pdf_text = None
             st.session_state.uploaded_pdf_name = None
+            st.session_state.uploaded_pdf_context = None
             st.rerun()
     
     st.divider()
@@ -378,7 +387,7 @@ with st.sidebar:
     
     # Query suggestions
     st.subheader("💡 Suggestions")
-    suggestions = QuerySuggestions.get_suggestions(3)
+    suggestions = get_suggestions(3)
     for idx, suggestion in enumerate(suggestions):
         # Use index to ensure unique keys
         if st.button(suggestion, key=f"suggest_{idx}", use_container_width=True):
@@ -406,9 +415,9 @@ with st.sidebar:
 
 
 # Analytics panel
-if st.session_state.show_analytics and st.session_state.analytics:
+if st.session_state.show_analytics and st.session_state.initialized:
     with st.expander("📊 Usage Analytics", expanded=True):
-        insights = st.session_state.analytics.get_insights()
+        insights = get_analytics().get_insights()
         if insights.get('total_queries', 0) > 0:
             col1, col2, col3 = st.columns(3)
             with col1:
@@ -447,13 +456,6 @@ if not st.session_state.initialized:
             st.balloons()  # Celebration effect
             st.rerun()  # Refresh to show initialized state
         else:
-            st.error("❌ **Initialization failed.** Please check the error messages above.")
-            st.info("""
-            **Troubleshooting:**
-            1. Make sure you have set `GEMINI_API_KEY` in your `.env` file
-            2. Ensure `data/gitlab_chunks.json` exists (run `python src/scraper.py` if needed)
-            3. Check that all dependencies are installed
-            """)
             st.stop()
 
 # Display chat history or empty state
@@ -472,8 +474,7 @@ with chat_container:
         </div>
         """, unsafe_allow_html=True)
         
-        # Example questions in columns
-        col1, col2 = st.columns(2)
+        # Example questions as a single pills widget
         example_questions = [
             "What is GitLab's approach to transparency?",
             "How does GitLab handle remote work?",
@@ -483,50 +484,28 @@ with chat_container:
             "How does GitLab handle security?"
         ]
         
-        for i, question in enumerate(example_questions):
-            col = col1 if i % 2 == 0 else col2
-            with col:
-                if st.button(f"💬 {question}", key=f"example_{i}", use_container_width=True):
-                    # Trigger response generation by setting a flag (don't add message here, let processing handle it)
-                    st.session_state.pending_query = question
-                    st.rerun()
+        # The callback queues the question before this rerun reaches the prompt handler below
+        # (don't add the message here, let processing handle it)
+        st.pills(
+            "Try asking:",
+            options=example_questions,
+            default=None,
+            key="example_question",
+            label_visibility="collapsed",
+            on_change=queue_example_question
+        )
     else:
-        # Display existing messages
-        for idx, message in enumerate(st.session_state.messages):
+        # Display only the most recent messages to keep widget count bounded
+        visible = st.session_state.visible_msgs
+        start = max(0, len(st.session_state.messages) - visible)
+        if start > 0 and st.button(f"⬆️ Load {MESSAGES_PAGE_SIZE} earlier messages", key="load_earlier"):
+            st.session_state.visible_msgs = visible + MESSAGES_PAGE_SIZE
+            st.rerun()
+        
+        for idx, message in enumerate(st.session_state.messages[start:], start=start):
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
-                
-                # Show sources if available
-                if "sources" in message and message["sources"]:
-                    with st.expander("📚 Sources", expanded=False):
-                        for source in message["sources"]:
-                            st.markdown(f"- {format_source_citation(source)}")
-                
-                # Show confidence and performance if available
-                if "confidence" in message:
-                    confidence_badge = get_confidence_badge(message['confidence'])
-                    performance_info = ""
-                    if "response_time" in message:
-                        performance_info = f'<span class="performance-badge">⚡ {message["response_time"]:.2f}s</span>'
-                    st.caption(f"Confidence: {confidence_badge}{performance_info}", unsafe_allow_html=True)
-                
-                # Feedback buttons for assistant messages (Product Thinking: Feedback Loop)
-                if message["role"] == "assistant" and idx > 0:
-                    col1, col2, col3 = st.columns([1, 1, 10])
-                    with col1:
-                        feedback_key = f"feedback_up_{idx}"
-                        is_up = st.session_state.feedback_data.get(feedback_key, False)
-                        if st.button("👍", key=feedback_key, help="This answer was helpful"):
-                            st.session_state.feedback_data[feedback_key] = not is_up
-                            if not is_up:
-                                st.success("Thanks for your feedback!")
-                    with col2:
-                        feedback_key = f"feedback_down_{idx}"
-                        is_down = st.session_state.feedback_data.get(feedback_key, False)
-                        if st.button("👎", key=feedback_key, help="This answer needs improvement"):
-                            st.session_state.feedback_data[feedback_key] = not is_down
-                            if not is_down:
-                                st.info("Thanks! We'll use this to improve.")
+                render_message_details(message, idx)
 
 # Always show chat input (must be called every render)
 chat_input_prompt = st.chat_input("Ask a question about GitLab's Handbook or Direction pages...")
@@ -551,79 +530,86 @@ if prompt:
     # Generate response
     with st.chat_message("assistant"):
         start_time = time.time()
+        response_displayed = False
         
-        with st.spinner("🔍 Searching GitLab Handbook..."):
-            try:
-                # Show context preview (transparency feature)
-                try:
-                    context_preview = st.session_state.chatbot.get_context_preview(prompt)
-                    if context_preview:
-                        with st.expander("🔍 Context Preview (Transparency)", expanded=False):
-                            st.caption("These are the sources being used to answer your question:")
-                            for ctx in context_preview:
-                                st.markdown(f"**{ctx['section_title']}**")
-                                st.markdown(f"🔗 [{ctx['url']}]({ctx['url']})")
-                                st.markdown(f"*{ctx['preview']}*")
-                                st.divider()
-                except Exception as e:
-                    st.debug(f"Context preview error: {str(e)}")
-                
-                # Get additional context from uploaded PDF if available
-                additional_context = None
-                if st.session_state.uploaded_pdf_text:
-                    # Chunk PDF text to fit within token limits
-                    pdf_text = st.session_state.uploaded_pdf_text
-                    # Limit PDF context to ~1000 tokens to avoid overwhelming the prompt
-                    import tiktoken
-                    encoding = tiktoken.get_encoding("cl100k_base")
-                    pdf_tokens = encoding.encode(pdf_text)
-                    if len(pdf_tokens) > 1000:
-                        pdf_text = encoding.decode(pdf_tokens[:1000])
-                        pdf_text += "\n\n[PDF content truncated for length...]"
-                    additional_context = pdf_text
+        # Show PDF indicator if PDF was used
+        if st.session_state.uploaded_pdf_text:
+            st.info(f"📄 **Using additional context from:** {st.session_state.uploaded_pdf_name}")
+        
+        try:
+            with st.spinner("🔍 Searching GitLab Handbook..."):
+                # Get additional context from uploaded PDF if available (already truncated at upload)
+                additional_context = st.session_state.uploaded_pdf_context
                 
-                response = st.session_state.chatbot.generate_response(
-                    prompt, 
-                    additional_context=additional_context
+                # Reuse cached answers for repeated standalone questions. Skipped when a PDF adds context,
+                # for follow-ups (the answer depends on this conversation) and for queries the guardrail
+                # rejects (checked first so a blocked query never gets a cached answer)
+                is_appropriate, _ = st.session_state.chatbot.check_query_appropriateness(prompt)
+                use_cache = (
+                    additional_context is None
+                    and is_appropriate
+                    and not st.session_state.chatbot.conversation_history
                 )
-                response_time = time.time() - start_time
-                response['response_time'] = response_time
-            except Exception as e:
-                st.error(f"Error generating response: {str(e)}")
-                response = {
-                    'response': "I apologize, but I encountered an error while processing your question. Please try again or rephrase your question.",
-                    'sources': [],
-                    'confidence': 'low',
-                    'context_used': False,
-                    'error': str(e)
-                }
+                semantic_cache = get_semantic_cache() if use_cache else None
+                query_embedding = None
+                response = None
+                if semantic_cache is not None:
+                    query_embedding = semantic_cache.embed(prompt)
+                    cached_response = semantic_cache.lookup(query_embedding)
+                    if cached_response is not None:
+                        response = dict(cached_response)
+                        st.session_state.chatbot.add_to_history(prompt, response['response'])
+            
+            if response is not None:
+                st.markdown(response['response'])
+            else:
+                # Stream the answer so text appears as soon as Gemini produces it
+                # On a cache miss the prompt's embedding is reused for retrieval
+                st.write_stream(st.session_state.chatbot.generate_response_stream(
+                    prompt, 
+                    additional_context=additional_context,
+                    query_embedding=query_embedding
+                ))
+                response = st.session_state.chatbot.last_response
+                if semantic_cache is not None and 'error' not in response and not response.get('guardrail_triggered'):
+                    semantic_cache.add(query_embedding, dict(response))
+            response_displayed = True
+            response_time = time.time() - start_time
+            response['response_time'] = response_time
+        except Exception as e:
+            st.error(f"Error generating response: {str(e)}")
+            response = {
+                'response': "I apologize, but I encountered an error while processing your question. Please try again or rephrase your question.",
+                'sources': [],
+                'confidence': 'low',
+                'context_used': False,
+                'error': str(e)
+            }
         
         # Track in analytics
-        if st.session_state.analytics:
-            st.session_state.analytics.track_query(prompt, response)
+        if st.session_state.initialized:
+            get_analytics().track_query(prompt, response)
         
-        # Show PDF indicator if PDF was used
-        if st.session_state.uploaded_pdf_text:
-            st.info(f"📄 **Using additional context from:** {st.session_state.uploaded_pdf_name}")
+        # Display response (already streamed on success)
+        if not response_displayed:
+            st.markdown(response['response'])
         
-        # Display response
-        st.markdown(response['response'])
+        # Add to messages with performance data
+        message_data = {
+            "role": "assistant",
+            "content": response['response'],
+            "sources": response['sources'],
+            "confidence": response['confidence'],
+            "response_time": response.get('response_time', 0),
+            "context_preview": response.get('context_preview', [])
+        }
         
-        # Display sources
-        if response['sources']:
-            with st.expander("📚 Sources", expanded=True):
-                for source in response['sources']:
-                    st.markdown(f"- {format_source_citation(source)}")
-                    if source.get('relevance_score'):
-                        st.progress(source['relevance_score'])
-        else:
-            st.info("ℹ️ No specific sources found. Answer generated from general knowledge.")
+        # Same rendering as the chat history; keyed by the index this message is about
+        # to get so widget state (feedback, preview toggle) carries over on rerun
+        render_message_details(message_data, len(st.session_state.messages), expand_sources=True)
         
-        # Display confidence with better styling
-        confidence = response.get('confidence', 'unknown')
-        confidence_emoji = get_confidence_badge(confidence)
-        confidence_class = f"confidence-{confidence}" if confidence in ['high', 'medium', 'low'] else ""
-        st.markdown(f'<p class="{confidence_class}">Confidence: {confidence_emoji} {confidence.upper()}</p>', unsafe_allow_html=True)
+        if not response['sources']:
+            st.info("ℹ️ No specific sources found. Answer generated from general knowledge.")
         
         # Show guardrail warning if triggered
         if response.get('guardrail_triggered'):
@@ -637,14 +623,6 @@ if prompt:
         if 'error' in response:
             st.error(f"⚠️ **Error:** {response['error']}")
         
-        # Add to messages with performance data
-        message_data = {
-            "role": "assistant",
-            "content": response['response'],
-            "sources": response['sources'],
-            "confidence": response['confidence'],
-            "response_time": response.get('response_time', 0)
-        }
         st.session_state.messages.append(message_data)
     
     # Auto-scroll (Streamlit handles this automatically)
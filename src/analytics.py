@@ -3,134 +3,190 @@ Analytics and Insights Module
 Tracks usage patterns and provides insights
 """
 
-from typing import List, Dict
-from collections import Counter
-import json
+from typing import Deque, List, Dict
+from collections import Counter, deque
+from itertools import islice
+import atexit
 import os
+import threading
 from datetime import datetime
 
+from jsonio import dumps, loads
+
 
 class Analytics:
     """Track and analyze chatbot usage"""
     
-    def __init__(self, data_dir: str = 'data'):
+    def __init__(self, data_dir: str = 'data', flush_every: int = 50):
         self.data_dir = data_dir
-        self.analytics_file = os.path.join(data_dir, 'analytics.json')
+        self.analytics_file = os.path.join(data_dir, 'analytics.json')  # Counters only
+        self.queries_file = os.path.join(data_dir, 'analytics.jsonl')  # Append-only query log
         os.makedirs(data_dir, exist_ok=True)
+        self._lock = threading.Lock()  # One instance is shared by every Streamlit session thread
         self.load_analytics()
+        
+        # Buffer writes: save every `flush_every` queries and on interpreter exit
+        self._flush_every = flush_every
+        self._dirty_count = 0
+        self._jsonl = open(self.queries_file, 'ab', buffering=1 << 16)
+        atexit.register(self.close)
+    
+    def close(self):
+        """Save and close the query log (e.g. before the shared instance is replaced)"""
+        with self._lock:
+            if self._jsonl.closed:
+                return
+            self._save()
+            self._jsonl.close()
+            atexit.unregister(self.close)
     
     def load_analytics(self):
         """Load analytics data"""
         if os.path.exists(self.analytics_file):
-            with open(self.analytics_file, 'r') as f:
-                self.data = json.load(f)
-            # Convert dicts back to Counter objects for proper incrementing
-            if isinstance(self.data.get('sources_accessed'), dict):
-                self.data['sources_accessed'] = Counter(self.data['sources_accessed'])
-            if isinstance(self.data.get('confidence_distribution'), dict):
-                self.data['confidence_distribution'] = Counter(self.data['confidence_distribution'])
+            with open(self.analytics_file, 'rb') as f:
+                self.data = loads(f.read())
+            # Older files kept the query list inline; move it to the JSONL log once
+            legacy_queries = self.data.pop('queries', None)
+            if legacy_queries and not os.path.exists(self.queries_file):
+                with open(self.queries_file, 'wb') as f:
+                    f.writelines(dumps(entry) + b"\n" for entry in legacy_queries)
+            self.data['queries'] = self._load_recent_queries()
+            # Counters are always Counter objects from here on (hot paths rely on it)
+            self.data['sources_accessed'] = Counter(self.data.get('sources_accessed') or {})
+            self.data['confidence_distribution'] = Counter(self.data.get('confidence_distribution') or {})
         else:
             self.data = {
                 'total_queries': 0,
-                'queries': [],
+                'queries': self._load_recent_queries(),
                 'sources_accessed': Counter(),
                 'confidence_distribution': Counter(),
                 'guardrail_triggers': 0,
                 'errors': 0
             }
+        
+        # Plain-dict snapshots of the counters for saving; reset to None whenever a counter changes
+        self._sources_dict_cache = None
+        self._confidence_dict_cache = None
+    
+    def _load_recent_queries(self, limit: int = 1000) -> Deque[Dict]:
+        """Read the last `limit` entries of the JSONL query log (bounded deque, O(1) eviction)"""
+        queries = deque(maxlen=limit)
+        if os.path.exists(self.queries_file):
+            with open(self.queries_file, 'rb') as f:
+                lines = deque(f, maxlen=limit)
+            queries.extend(loads(line) for line in lines if line.strip())
+        return queries
     
     def save_analytics(self):
         """Save analytics data"""
-        # Convert Counter objects to dict for JSON serialization
-        data_to_save = self.data.copy()
-        if isinstance(data_to_save.get('sources_accessed'), Counter):
-            data_to_save['sources_accessed'] = dict(data_to_save['sources_accessed'])
-        if isinstance(data_to_save.get('confidence_distribution'), Counter):
-            data_to_save['confidence_distribution'] = dict(data_to_save['confidence_distribution'])
-        
-        with open(self.analytics_file, 'w') as f:
-            json.dump(data_to_save, f, indent=2)
+        with self._lock:
+            self._save()
     
-    def track_query(self, query: str, response: Dict):
-        """Track a query and its response"""
-        self.data['total_queries'] += 1
-        
-        query_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'query': query,
-            'confidence': response.get('confidence', 'unknown'),
-            'sources_count': len(response.get('sources', [])),
-            'guardrail_triggered': response.get('guardrail_triggered', False),
-            'error': 'error' in response
-        }
-        
-        self.data['queries'].append(query_entry)
-        
-        # Track sources
-        for source in response.get('sources', []):
-            url = source.get('url', 'unknown')
-            # Ensure sources_accessed is a Counter (handles both Counter and dict)
-            if not isinstance(self.data['sources_accessed'], Counter):
-                self.data['sources_accessed'] = Counter(self.data['sources_accessed'])
-            self.data['sources_accessed'][url] += 1
-        
-        # Track confidence
-        self.data['confidence_distribution'][response.get('confidence', 'unknown')] += 1
+    def _save(self):
+        """Write counters and flush the query log (caller holds the lock)"""
+        # Nothing tracked since the last save (e.g. atexit right after a batch flush)
+        if self._dirty_count == 0 and os.path.exists(self.analytics_file):
+            return
         
-        # Track guardrails
-        if response.get('guardrail_triggered'):
-            self.data['guardrail_triggers'] += 1
+        # Query entries are already in the JSONL log; just push out the buffer
+        # save_analytics only runs every `flush_every` queries (and at exit), so fsync here is batched
+        if not self._jsonl.closed:
+            self._jsonl.flush()
+            os.fsync(self._jsonl.fileno())
         
-        # Track errors
-        if 'error' in response:
-            self.data['errors'] += 1
+        # Convert Counter objects to dict for JSON serialization (reused while the counters are unchanged)
+        if self._sources_dict_cache is None:
+            self._sources_dict_cache = dict(self.data['sources_accessed'])
+        if self._confidence_dict_cache is None:
+            self._confidence_dict_cache = dict(self.data['confidence_distribution'])
+        data_to_save = {k: v for k, v in self.data.items() if k != 'queries'}
+        data_to_save['sources_accessed'] = self._sources_dict_cache
+        data_to_save['confidence_distribution'] = self._confidence_dict_cache
         
-        # Keep only last 1000 queries
-        if len(self.data['queries']) > 1000:
-            self.data['queries'] = self.data['queries'][-1000:]
-        
-        self.save_analytics()
+        # Write to a sibling temp file and swap it in atomically so a crash never leaves a torn file
+        tmp_file = self.analytics_file + '.tmp'
+        with open(tmp_file, 'wb', buffering=1 << 16) as f:
+            f.write(dumps(data_to_save))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.analytics_file)
+        self._dirty_count = 0
+    
+    def track_query(self, query: str, response: Dict):
+        """Track a query and its response"""
+        with self._lock:
+            # A closed instance has been replaced; reviving it would leave two writers of analytics.json
+            if self._jsonl.closed:
+                raise ValueError("Analytics instance is closed")
+            
+            self.data['total_queries'] += 1
+            
+            query_entry = {
+                'timestamp': datetime.now().isoformat(),
+                'query': query,
+                'confidence': response.get('confidence', 'unknown'),
+                'sources_count': len(response.get('sources', [])),
+                'guardrail_triggered': response.get('guardrail_triggered', False),
+                'error': 'error' in response
+            }
+            
+            self.data['queries'].append(query_entry)
+            self._jsonl.write(dumps(query_entry) + b"\n")
+            
+            # Track sources
+            sources = response.get('sources', [])
+            for source in sources:
+                url = source.get('url', 'unknown')
+                self.data['sources_accessed'][url] += 1
+            if sources:
+                self._sources_dict_cache = None
+            
+            # Track confidence
+            self.data['confidence_distribution'][response.get('confidence', 'unknown')] += 1
+            self._confidence_dict_cache = None
+            
+            # Track guardrails
+            if response.get('guardrail_triggered'):
+                self.data['guardrail_triggers'] += 1
+            
+            # Track errors
+            if 'error' in response:
+                self.data['errors'] += 1
+            
+            self._dirty_count += 1
+            if self._dirty_count >= self._flush_every:
+                self._save()
     
     def get_insights(self) -> Dict:
         """Get analytics insights"""
-        # Ensure Counter objects are used (convert from dict if needed)
-        if isinstance(self.data.get('sources_accessed'), dict):
-            self.data['sources_accessed'] = Counter(self.data['sources_accessed'])
-        if isinstance(self.data.get('confidence_distribution'), dict):
-            self.data['confidence_distribution'] = Counter(self.data['confidence_distribution'])
-        
-        total = self.data['total_queries']
-        if total == 0:
+        with self._lock:
+            total = self.data['total_queries']
+            if total == 0:
+                return {
+                    'total_queries': 0,
+                    'message': 'No queries yet'
+                }
+            
+            # Most accessed sources (always a Counter; most_common(n) uses a heap)
+            top_sources = dict(self.data['sources_accessed'].most_common(5))
+            
+            # Average confidence
+            conf_dist = self.data['confidence_distribution']
+            if conf_dist:
+                high_conf = conf_dist.get('high', 0)
+                medium_conf = conf_dist.get('medium', 0)
+                low_conf = conf_dist.get('low', 0)
+                avg_confidence_score = (high_conf * 1.0 + medium_conf * 0.5 + low_conf * 0.0) / total
+            else:
+                avg_confidence_score = 0
+            
             return {
-                'total_queries': 0,
-                'message': 'No queries yet'
+                'total_queries': total,
+                'top_sources': top_sources,
+                'confidence_distribution': dict(conf_dist),
+                'average_confidence': round(avg_confidence_score, 2),
+                'guardrail_triggers': self.data['guardrail_triggers'],
+                'error_rate': round(self.data['errors'] / total * 100, 2) if total > 0 else 0,
+                'recent_queries': list(islice(self.data['queries'], max(0, len(self.data['queries']) - 10), None))
             }
-        
-        # Most accessed sources
-        sources = self.data['sources_accessed']
-        if isinstance(sources, Counter):
-            top_sources = dict(sources.most_common(5))
-        else:
-            # Fallback for dict: sort by value and take top 5
-            top_sources = dict(sorted(sources.items(), key=lambda x: x[1], reverse=True)[:5])
-        
-        # Average confidence
-        conf_dist = self.data['confidence_distribution']
-        if conf_dist:
-            high_conf = conf_dist.get('high', 0)
-            medium_conf = conf_dist.get('medium', 0)
-            low_conf = conf_dist.get('low', 0)
-            avg_confidence_score = (high_conf * 1.0 + medium_conf * 0.5 + low_conf * 0.0) / total
-        else:
-            avg_confidence_score = 0
-        
-        return {
-            'total_queries': total,
-            'top_sources': top_sources,
-            'confidence_distribution': dict(conf_dist),
-            'average_confidence': round(avg_confidence_score, 2),
-            'guardrail_triggers': self.data['guardrail_triggers'],
-            'error_rate': round(self.data['errors'] / total * 100, 2) if total > 0 else 0,
-            'recent_queries': self.data['queries'][-10:] if len(self.data['queries']) > 10 else self.data['queries']
-        }
 
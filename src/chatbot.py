@@ -3,38 +3,47 @@ GenAI Chatbot Implementation using LangChain + Google Gemini API
 Includes custom guardrails, transparency features, and context management
 """
 
+import functools
 import os
-from typing import List, Dict, Optional
+import re
+from collections import deque
+from itertools import chain, islice
+from typing import Deque, Iterator, List, Dict, Optional
+import numpy as np
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from langchain_core.documents import Document
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import PromptTemplate
 
 load_dotenv()
 
+# Number of chunks retrieved per question
+DEFAULT_CONTEXT_CHUNKS = 5
 
-class Chatbot:
-    """GenAI Chatbot with RAG capabilities using LangChain"""
-    
-    def __init__(self, vector_store):
-        self.vector_store = vector_store
-        self.api_key = os.getenv('GEMINI_API_KEY')
-        
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-        
-        # Initialize LangChain LLM with Gemini
-        # Note: gemini-pro is deprecated, using gemini-1.5-flash (faster) or gemini-1.5-pro (better quality)
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",  # Updated: faster and free tier friendly
-            google_api_key=self.api_key,
-            temperature=0.7,
-            convert_system_message_to_human=True
-        )
-        
-        # Custom prompt template with guardrails
-        self.prompt_template = PromptTemplate(
-            input_variables=["context", "question", "chat_history"],
-            template="""You are a helpful assistant that answers questions about GitLab's Handbook and Direction pages.
+# Messages kept in memory per conversation (only the last 4 go into the prompt)
+MAX_HISTORY_MESSAGES = 20
+
+# Average search distance below 0.3 -> high confidence, below 0.5 -> medium, else low
+_CONFIDENCE_THRESHOLDS = np.array([0.3, 0.5], dtype=np.float32)
+_CONFIDENCE_LEVELS = ('high', 'medium', 'low')
+
+# A line starting with "Sources:" (any case); everything from there on is dropped
+_SOURCES_RE = re.compile(r'(?im)^[ \t]*sources:.*$')
+
+# Canned answer when retrieval finds nothing (no LLM call is made)
+NO_CONTEXT_RESPONSE = "I don't have information on that in the provided GitLab documentation."
+
+# Guardrail: topics the chatbot refuses, matched in a single regex scan of the query
+INAPPROPRIATE_KEYWORDS = (
+    'hack', 'exploit', 'bypass', 'unauthorized access',
+    'personal information', 'private data', 'confidential'
+)
+_GUARD_RE = re.compile('|'.join(re.escape(k) for k in INAPPROPRIATE_KEYWORDS), re.IGNORECASE)
+
+
+# Prompt template with guardrails; only {chat_history}, {context} and {question} vary per call,
+# so it is filled with str.format instead of a LangChain PromptTemplate
+_PROMPT_TMPL = """You are a helpful assistant that answers questions about GitLab's Handbook and Direction pages.
 
 IMPORTANT GUIDELINES:
 1. Only answer questions based on the provided context from GitLab's documentation
@@ -65,12 +74,48 @@ Context from GitLab documentation:
 User question: {question}
 
 Please provide a comprehensive, well-structured answer that fully explains the topic based on the context above. Include relevant details, examples, and key points. Make sure your explanation is clear and helpful. Do not list sources in your response."""
+
+
+def _to_documents(results: List[Dict]) -> List[Document]:
+    """Wrap vector_store.search results as LangChain Documents (no second retrieval)"""
+    return [
+        Document(
+            page_content=r['content'],
+            metadata={
+                'source_url': r['source_url'],
+                'section_title': r['section_title'],
+                'start_char': r['start_char'],
+                'end_char': r['end_char']
+            }
         )
+        for r in results
+    ]
+
+
+def _stream_safe_end(text: str) -> int:
+    """How much of a partial response can be shown: all of it, unless its last line may still become a "Sources:" line"""
+    line_start = text.rfind('\n') + 1
+    if 'sources:'.startswith(text[line_start:].lstrip(' \t').lower()):
+        return line_start
+    return len(text)
+
+
+class Chatbot:
+    """GenAI Chatbot with RAG capabilities using LangChain"""
+    
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
         
-        # Create retriever with custom metadata
-        self.retriever = vector_store.vector_store.as_retriever(
-            search_kwargs={"k": 5}
-        )
+        # Memoized vector search keyed on (query, n_results); the index is static at runtime
+        self._search = functools.lru_cache(maxsize=128)(vector_store.search)
+        # Short-lived cache of formatted previews keyed on (query, max_chunks)
+        self._preview_cache = TTLCache(maxsize=256, ttl=30)
+        self.api_key = os.getenv('GEMINI_API_KEY')
+        
+        if not self.api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        
+        # The Gemini client is built lazily on first use (see llm)
         
         # Helper function to format documents
         def format_docs(docs):
@@ -79,81 +124,194 @@ Please provide a comprehensive, well-structured answer that fully explains the t
         self.format_docs = format_docs
         
         # Conversation history for custom tracking
-        self.conversation_history: List[Dict] = []
+        self.conversation_history: Deque[Dict] = deque(maxlen=MAX_HISTORY_MESSAGES)
+        
+        # Full response dict of the most recent generate_response_stream() call
+        self.last_response: Optional[Dict] = None
+    
+    @functools.cached_property
+    def llm(self) -> ChatGoogleGenerativeAI:
+        """LangChain Gemini client, created on the first query"""
+        # Note: gemini-pro is deprecated, using gemini-1.5-flash (faster) or gemini-1.5-pro (better quality)
+        return ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash",  # Updated: faster and free tier friendly
+            google_api_key=self.api_key,
+            temperature=0.7,
+            convert_system_message_to_human=True
+        )
     
     def format_context(self, search_results: List[Dict]) -> str:
         """Format search results into context for transparency"""
         if not search_results:
             return "No relevant context found."
         
-        context_parts = []
-        for i, result in enumerate(search_results, 1):
-            context_parts.append(
-                f"[Source {i}]\n"
-                f"Section: {result['section_title']}\n"
-                f"URL: {result['source_url']}\n"
-                f"Content: {result['content']}\n"
-            )
-        
-        return "\n".join(context_parts)
+        return "\n".join(
+            f"[Source {i}]\n"
+            f"Section: {result['section_title']}\n"
+            f"URL: {result['source_url']}\n"
+            f"Content: {result['content']}\n"
+            for i, result in enumerate(search_results, 1)
+        )
     
     def extract_sources(self, source_documents, search_results: List[Dict] = None) -> List[Dict]:
         """Extract source information for citations with custom metadata"""
-        sources = []
-        seen_urls = set()
-        
-        # Use source_documents from LangChain if available
-        if source_documents:
-            for doc in source_documents:
-                metadata = doc.metadata
-                url = metadata.get('source_url', '')
-                if url and url not in seen_urls:
-                    sources.append({
-                        'url': url,
-                        'section_title': metadata.get('section_title', ''),
-                        'start_char': metadata.get('start_char', 0),
-                        'end_char': metadata.get('end_char', 0),
-                        'relevance_score': None
-                    })
-                    seen_urls.add(url)
+        # LangChain source_documents first, then search_results (for transparency preview),
+        # normalized to (url, section_title, start_char, end_char, relevance_score)
+        candidates = chain(
+            (
+                (doc.metadata.get('source_url', ''), doc.metadata.get('section_title', ''),
+                 doc.metadata.get('start_char', 0), doc.metadata.get('end_char', 0), None)
+                for doc in source_documents or ()
+            ),
+            (
+                (result['source_url'], result['section_title'], result['start_char'], result['end_char'],
+                 1 - result['distance'] if result.get('distance') else None)
+                for result in search_results or ()
+            )
+        )
         
-        # Also use search_results if provided (for transparency preview)
-        if search_results:
-            for result in search_results:
-                url = result['source_url']
-                if url not in seen_urls:
-                    distance = result.get('distance', 0)
-                    sources.append({
-                        'url': url,
-                        'section_title': result['section_title'],
-                        'start_char': result['start_char'],
-                        'end_char': result['end_char'],
-                        'relevance_score': 1 - distance if distance else None
-                    })
-                    seen_urls.add(url)
+        # Single dedup pass over both inputs, keeping only real http(s) URLs
+        # (dict keyed on URL: first occurrence wins, insertion order is preserved)
+        sources = {}
+        for url, section_title, start_char, end_char, relevance_score in candidates:
+            if url not in sources and url.startswith(("http://", "https://")):
+                sources[url] = {
+                    'url': url,
+                    'section_title': section_title,
+                    'start_char': start_char,
+                    'end_char': end_char,
+                    'relevance_score': relevance_score
+                }
         
-        return sources
+        return list(sources.values())
     
     def check_query_appropriateness(self, query: str) -> tuple[bool, Optional[str]]:
         """Custom Guardrail: Check if query is appropriate"""
-        inappropriate_keywords = [
-            'hack', 'exploit', 'bypass', 'unauthorized access',
-            'personal information', 'private data', 'confidential'
-        ]
-        
-        query_lower = query.lower()
-        for keyword in inappropriate_keywords:
-            if keyword in query_lower:
-                return False, f"I can only help with questions about GitLab's public Handbook and Direction pages. I cannot assist with {keyword}."
+        match = _GUARD_RE.search(query)
+        if match:
+            keyword = match.group(0).lower()
+            return False, f"I can only help with questions about GitLab's public Handbook and Direction pages. I cannot assist with {keyword}."
         
         return True, None
     
+    def _guardrail_response(self, guardrail_message: str) -> Dict:
+        """Response returned when the guardrail rejects a query"""
+        return {
+            'response': guardrail_message,
+            'sources': [],
+            'confidence': 'low',
+            'context_used': False,
+            'guardrail_triggered': True
+        }
+    
+    def _no_context_response(self, query: str) -> Dict:
+        """Canned answer for queries with no retrieved context (skips the LLM)"""
+        self.add_to_history(query, NO_CONTEXT_RESPONSE)
+        return {
+            'response': NO_CONTEXT_RESPONSE,
+            'sources': [],
+            'confidence': 'low',
+            'context_used': False,
+            'guardrail_triggered': False,
+            'context_preview': []
+        }
+    
+    def _error_response(self, e: Exception) -> Dict:
+        """Response returned when retrieval or generation fails"""
+        error_msg = f"I encountered an error: {str(e)}. Please try again."
+        return {
+            'response': error_msg,
+            'sources': [],
+            'confidence': 'low',
+            'context_used': False,
+            'error': str(e)
+        }
+    
+    def _build_prompt(
+        self,
+        query: str,
+        search_results: List[Dict],
+        include_history: bool,
+        additional_context: Optional[str]
+    ) -> str:
+        """Format the LLM prompt from this turn's search results"""
+        # Reuse the search results as Documents instead of re-embedding the query in a retriever
+        source_documents = _to_documents(search_results)
+        
+        # Format context from documents
+        context = self.format_docs(source_documents)
+        
+        # Add additional context (e.g., from uploaded PDF) if provided
+        if additional_context:
+            context = f"{context}\n\n--- Additional Context (from uploaded document) ---\n{additional_context}"
+        
+        # Build chat history string
+        chat_history_str = ""
+        if include_history and self.conversation_history:
+            recent = islice(self.conversation_history, max(0, len(self.conversation_history) - 4), None)
+            chat_history_str = "".join(
+                f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+                for msg in recent
+            )
+        
+        # Format prompt with context
+        formatted_prompt = _PROMPT_TMPL.format(
+            context=context,
+            question=query,
+            chat_history=chat_history_str
+        )
+        return formatted_prompt
+    
+    def _finalize_response(
+        self,
+        query: str,
+        response_text: str,
+        search_results: List[Dict],
+        context_used: bool
+    ) -> Dict:
+        """Clean the LLM output, attach sources/confidence and record the exchange"""
+        # Clean response text - remove any LLM-generated source sections
+        # LLM might add "Sources:" section even though we told it not to
+        response_text = _SOURCES_RE.split(response_text, maxsplit=1)[0].strip()
+        
+        # Extract sources ONLY from actual retrieved documents (not from LLM response)
+        # The prompt's documents wrap these same results, so one pass over them is enough and
+        # keeps the distance-based relevance scores; invalid URLs are dropped there too
+        sources = self.extract_sources(None, search_results)
+        
+        # Determine confidence based on search results
+        if search_results:
+            distances = np.fromiter(
+                (r.get('distance', 1.0) for r in search_results),
+                dtype=np.float32,
+                count=len(search_results)
+            )
+            # side='right' keeps the strict '<' comparison at the thresholds
+            bucket = int(np.searchsorted(_CONFIDENCE_THRESHOLDS, distances.mean(), side='right'))
+            confidence = _CONFIDENCE_LEVELS[bucket]
+        else:
+            confidence = 'low'
+        
+        # Update custom conversation history
+        self.add_to_history(query, response_text)
+        
+        return {
+            'response': response_text,
+            'sources': sources,
+            'confidence': confidence,
+            'context_used': context_used,
+            'guardrail_triggered': False,
+            # Transparency panel data, reusing this turn's search instead of searching again
+            'context_preview': self._format_context_preview(search_results[:3])
+        }
+    
     def generate_response(
         self, 
         query: str, 
         include_history: bool = True,
-        max_context_chunks: int = 5,
-        additional_context: Optional[str] = None
+        max_context_chunks: int = DEFAULT_CONTEXT_CHUNKS,
+        additional_context: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> Dict:
         """
         Generate response with RAG using LangChain, with custom features
@@ -163,130 +321,144 @@ Please provide a comprehensive, well-structured answer that fully explains the t
                 'response': str,
                 'sources': List[Dict],
                 'confidence': str,
-                'context_used': bool
+                'context_used': bool,
+                'context_preview': List[Dict]
             }
         """
         # Custom guardrail check (before LangChain processing)
         is_appropriate, guardrail_message = self.check_query_appropriateness(query)
         if not is_appropriate:
-            return {
-                'response': guardrail_message,
-                'sources': [],
-                'confidence': 'low',
-                'context_used': False,
-                'guardrail_triggered': True
-            }
+            return self._guardrail_response(guardrail_message)
         
         # Get search results for transparency and source extraction
-        search_results = self.vector_store.search(query, n_results=max_context_chunks)
+        search_results = self._retrieve(query, max_context_chunks, query_embedding)
         context_used = len(search_results) > 0
         
+        # Nothing to ground an answer on: skip the LLM round-trip
+        if not context_used and not additional_context:
+            return self._no_context_response(query)
+        
         try:
-            # Get source documents first for metadata
-            # Use invoke() for LangChain 0.1+ compatibility
-            try:
-                source_documents = self.retriever.invoke(query)
-            except AttributeError:
-                # Fallback for older LangChain versions
-                source_documents = self.retriever.get_relevant_documents(query)
-            
-            # Format context from documents
-            context = self.format_docs(source_documents)
-            
-            # Add additional context (e.g., from uploaded PDF) if provided
-            if additional_context:
-                context = f"{context}\n\n--- Additional Context (from uploaded document) ---\n{additional_context}"
-            
-            # Build chat history string
-            chat_history_str = ""
-            if include_history and self.conversation_history:
-                for msg in self.conversation_history[-4:]:
-                    role = "User" if msg['role'] == 'user' else "Assistant"
-                    chat_history_str += f"{role}: {msg['content']}\n"
-            
-            # Format prompt with context
-            formatted_prompt = self.prompt_template.format(
-                context=context,
-                question=query,
-                chat_history=chat_history_str
+            formatted_prompt = self._build_prompt(
+                query, search_results, include_history, additional_context
             )
             
             # Invoke LLM
             response = self.llm.invoke(formatted_prompt)
             response_text = response.content if hasattr(response, 'content') else str(response)
             
-            # Clean response text - remove any LLM-generated source sections
-            # LLM might add "Sources:" section even though we told it not to
-            if "Sources:" in response_text or "sources:" in response_text.lower():
-                # Remove everything after "Sources:" line
-                lines = response_text.split('\n')
-                cleaned_lines = []
-                for line in lines:
-                    if line.strip().lower().startswith('sources:'):
-                        break
-                    cleaned_lines.append(line)
-                response_text = '\n'.join(cleaned_lines).strip()
-            
-            # Extract sources ONLY from actual retrieved documents (not from LLM response)
-            sources = self.extract_sources(source_documents, search_results)
+            return self._finalize_response(query, response_text, search_results, context_used)
             
-            # Validate sources - ensure they have valid URLs
-            validated_sources = []
-            for source in sources:
-                if source.get('url') and source['url'].startswith('http'):
-                    validated_sources.append(source)
-            sources = validated_sources
+        except Exception as e:
+            return self._error_response(e)
+    
+    def generate_response_stream(
+        self, 
+        query: str, 
+        include_history: bool = True,
+        max_context_chunks: int = DEFAULT_CONTEXT_CHUNKS,
+        additional_context: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None
+    ) -> Iterator[str]:
+        """
+        Stream the response text as Gemini generates it (same pipeline as generate_response)
+        
+        Once the generator is exhausted, the full response dict (sources,
+        confidence, ...) is available as self.last_response
+        """
+        self.last_response = None
+        
+        # Custom guardrail check (before LangChain processing)
+        is_appropriate, guardrail_message = self.check_query_appropriateness(query)
+        if not is_appropriate:
+            self.last_response = self._guardrail_response(guardrail_message)
+            yield guardrail_message
+            return
+        
+        # Get search results for transparency and source extraction
+        search_results = self._retrieve(query, max_context_chunks, query_embedding)
+        context_used = len(search_results) > 0
+        
+        # Nothing to ground an answer on: skip the LLM round-trip
+        if not context_used and not additional_context:
+            self.last_response = self._no_context_response(query)
+            yield NO_CONTEXT_RESPONSE
+            return
+        
+        try:
+            formatted_prompt = self._build_prompt(
+                query, search_results, include_history, additional_context
+            )
             
-            # Determine confidence based on search results
-            if search_results:
-                avg_distance = sum(r.get('distance', 1) for r in search_results) / len(search_results)
-                if avg_distance < 0.3:
-                    confidence = 'high'
-                elif avg_distance < 0.5:
-                    confidence = 'medium'
-                else:
-                    confidence = 'low'
-            else:
-                confidence = 'low'
+            # Stream LLM output, stopping at any "Sources:" line so the text shown
+            # is the same text _finalize_response stores
+            response_text = ''
+            shown = 0
+            for chunk in self.llm.stream(formatted_prompt):
+                text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if not text:
+                    continue
+                # Only the line in progress before this chunk (and anything after it) can newly match
+                search_from = response_text.rfind('\n') + 1
+                response_text += text
+                match = _SOURCES_RE.search(response_text, search_from)
+                if match:
+                    response_text = response_text[:match.start()]
+                    break
+                safe_end = _stream_safe_end(response_text)
+                if safe_end > shown:
+                    yield response_text[shown:safe_end]
+                    shown = safe_end
             
-            # Update custom conversation history
-            self.conversation_history.append({'role': 'user', 'content': query})
-            self.conversation_history.append({'role': 'assistant', 'content': response_text})
+            if len(response_text) > shown:
+                yield response_text[shown:]
             
-            return {
-                'response': response_text,
-                'sources': sources,
-                'confidence': confidence,
-                'context_used': context_used,
-                'guardrail_triggered': False
-            }
+            self.last_response = self._finalize_response(
+                query, response_text, search_results, context_used
+            )
             
         except Exception as e:
-            error_msg = f"I encountered an error: {str(e)}. Please try again."
-            return {
-                'response': error_msg,
-                'sources': [],
-                'confidence': 'low',
-                'context_used': False,
-                'error': str(e)
-            }
+            self.last_response = self._error_response(e)
+            yield self.last_response['response']
+    
+    def _retrieve(self, query: str, max_context_chunks: int,
+                  query_embedding: Optional[List[float]] = None) -> List[Dict]:
+        """Vector search for a query, reusing its embedding when the caller already computed it"""
+        if query_embedding is not None:
+            return self.vector_store.search(query, max_context_chunks, query_embedding=query_embedding)
+        return self._search(query, max_context_chunks)
+    
+    def add_to_history(self, query: str, response_text: str):
+        """Record a question/answer exchange in the conversation history"""
+        self.conversation_history.append({'role': 'user', 'content': query})
+        self.conversation_history.append({'role': 'assistant', 'content': response_text})
     
     def clear_history(self):
         """Clear conversation history"""
-        self.conversation_history = []
+        self.conversation_history.clear()
     
     def get_history(self) -> List[Dict]:
         """Get conversation history"""
-        return self.conversation_history.copy()
+        return list(self.conversation_history)
     
     def get_context_preview(self, query: str, max_chunks: int = 3) -> List[Dict]:
         """Get preview of context that would be used (transparency feature)"""
-        search_results = self.vector_store.search(query, n_results=max_chunks)
+        key = (query, max_chunks)
+        preview = self._preview_cache.get(key)
+        if preview is None:
+            # Served from the same cached search generate_response uses for this query
+            search_results = self._search(query, max(max_chunks, DEFAULT_CONTEXT_CHUNKS))[:max_chunks]
+            preview = self._preview_cache[key] = self._format_context_preview(search_results)
+        return preview
+    
+    def _format_context_preview(self, search_results: List[Dict]) -> List[Dict]:
+        """Shorten search results into preview entries for the transparency panel"""
         return [
             {
                 'section_title': r['section_title'],
                 'url': r['source_url'],
-                'preview': r['content'][:200] + '...' if len(r['content']) > 200 else r['content']
+                # Slicing past the end is a no-op; [200:201] is non-empty only when content was cut
+                'preview': r['content'][:200] + ('...' if r['content'][200:201] else '')
             }
             for r in search_results
         ]
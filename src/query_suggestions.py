@@ -3,6 +3,7 @@ Query Suggestions Module
 Provides helpful query suggestions based on available content
 """
 
+from types import MappingProxyType
 from typing import List
 import random
 
@@ -10,7 +11,7 @@ import random
 class QuerySuggestions:
     """Generate query suggestions for users"""
     
-    SUGGESTIONS = [
+    SUGGESTIONS = (
         "What are GitLab's core values?",
         "How does GitLab handle remote work?",
         "What is GitLab's product direction?",
@@ -26,7 +27,31 @@ class QuerySuggestions:
         "What are GitLab's engineering principles?",
         "How does GitLab approach product development?",
         "What is GitLab's marketing strategy?",
-    ]
+    )
+    
+    # Built once at import; read-only view so callers can't mutate the shared lists
+    _CATEGORY_MAP = MappingProxyType({
+        'values': (
+            "What are GitLab's core values?",
+            "How does GitLab practice transparency?",
+            "What is GitLab's approach to collaboration?",
+        ),
+        'engineering': (
+            "What are GitLab's engineering principles?",
+            "How does GitLab handle code reviews?",
+            "What is GitLab's approach to testing?",
+        ),
+        'product': (
+            "What is GitLab's product direction?",
+            "How does GitLab prioritize features?",
+            "What is GitLab's product development process?",
+        ),
+        'people': (
+            "How does GitLab handle remote work?",
+            "What are GitLab's hiring practices?",
+            "How does GitLab approach diversity and inclusion?",
+        ),
+    })
     
     @classmethod
     def get_suggestions(cls, n: int = 4) -> List[str]:
@@ -36,27 +61,8 @@ class QuerySuggestions:
     @classmethod
     def get_category_suggestions(cls, category: str) -> List[str]:
         """Get suggestions for a specific category"""
-        category_map = {
-            'values': [
-                "What are GitLab's core values?",
-                "How does GitLab practice transparency?",
-                "What is GitLab's approach to collaboration?",
-            ],
-            'engineering': [
-                "What are GitLab's engineering principles?",
-                "How does GitLab handle code reviews?",
-                "What is GitLab's approach to testing?",
-            ],
-            'product': [
-                "What is GitLab's product direction?",
-                "How does GitLab prioritize features?",
-                "What is GitLab's product development process?",
-            ],
-            'people': [
-                "How does GitLab handle remote work?",
-                "What are GitLab's hiring practices?",
-                "How does GitLab approach diversity and inclusion?",
-            ]
-        }
-        return category_map.get(category.lower(), cls.get_suggestions(3))
+        suggestions = cls._CATEGORY_MAP.get(category.lower())
+        if suggestions is None:
+            return cls.get_suggestions(3)
+        return list(suggestions)
 
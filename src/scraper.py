@@ -3,14 +3,108 @@ GitLab Handbook and Direction Pages Scraper
 Scrapes content with metadata: source_url, section_title, start_char, end_char
 """
 
-import requests
-from bs4 import BeautifulSoup
-import json
+import aiohttp
+import asyncio
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from lxml import etree
+import lxml.html
 import os
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from urllib.parse import urljoin, urlparse
-import time
 import re
+import sqlite3
+import threading
+
+try:
+    import brotli  # Lets aiohttp decode 'br' responses
+except ImportError:
+    brotli = None
+
+from jsonio import dumps, loads
+
+
+# Main content area candidates, tried in order (adjust selectors based on GitLab's structure)
+_MAIN_CONTENT_XPATHS = (
+    etree.XPath('//main'),
+    etree.XPath('//article'),
+    etree.XPath('//div[contains(@class, "content") or contains(@class, "main") or contains(@class, "article")]'),
+    etree.XPath('//body'),
+)
+
+# Script, style, navigation, header, footer and sidebar elements, removed in one pass before extraction
+_STRIP_XPATH = etree.XPath('//script | //style | //nav | //header | //footer | //aside')
+
+# Headings and content elements under the main area (boilerplate already stripped).
+# <div> is deliberately excluded: its text is the text of the <p>/<li> inside it, which would be counted twice.
+# For the same reason a <p>/<li> nested in another <p>/<li> (<li><p>, nested lists) is left to its outermost one
+_SECTION_XPATH = etree.XPath(
+    './/*[self::h1 or self::h2 or self::h3 or self::h4 or self::h5 or self::h6'
+    ' or ((self::p or self::li) and not(ancestor::p or ancestor::li))]'
+)
+
+# Link discovery only needs anchors; everything else is skipped while parsing
+_LINK_STRAINER = SoupStrainer('a', href=True)
+
+_HEADING_TAGS = frozenset(('h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
+
+_WS_RE = re.compile(r'\s+')
+
+# Transient HTTP statuses worth retrying (rate limiting / server hiccups)
+_RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Digits are dropped from the content signature so date/counter variants of a page collapse together
+_DIGITS_RE = re.compile(r'\d+')
+
+# Bump whenever extraction output changes (_STRIP_XPATH, _SECTION_XPATH, extract_sections, signatures):
+# cached chunks from another version are discarded, since a 304 would otherwise keep serving them
+EXTRACTOR_VERSION = 1
+
+# Per-URL HTTP validators plus what was extracted last time, for conditional re-crawls
+_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    sha1 BLOB,
+    links TEXT,
+    chunks TEXT
+)
+"""
+
+# Store discovered links; cached chunks/signature only survive if the validators didn't change
+_CACHE_PUT_LINKS = """
+INSERT INTO pages (url, etag, last_modified, links) VALUES (?, ?, ?, ?)
+ON CONFLICT(url) DO UPDATE SET
+    sha1 = CASE WHEN pages.etag IS excluded.etag AND pages.last_modified IS excluded.last_modified
+                THEN pages.sha1 END,
+    chunks = CASE WHEN pages.etag IS excluded.etag AND pages.last_modified IS excluded.last_modified
+                  THEN pages.chunks END,
+    etag = excluded.etag,
+    last_modified = excluded.last_modified,
+    links = excluded.links
+"""
+
+# Store extracted chunks; cached links only survive if the validators didn't change
+_CACHE_PUT_CHUNKS = """
+INSERT INTO pages (url, etag, last_modified, sha1, chunks) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(url) DO UPDATE SET
+    links = CASE WHEN pages.etag IS excluded.etag AND pages.last_modified IS excluded.last_modified
+                 THEN pages.links END,
+    etag = excluded.etag,
+    last_modified = excluded.last_modified,
+    sha1 = excluded.sha1,
+    chunks = excluded.chunks
+"""
+
+# Common non-content URLs, matched in one case-insensitive scan
+_SKIP_RE = re.compile(
+    r'/search|/login|/logout|/sign|/api/'
+    r'|\.pdf|\.zip|\.jpg|\.png|\.gif|\.svg'
+    r'|#|mailto:|tel:|javascript:',
+    re.IGNORECASE
+)
 
 
 class GitLabScraper:
@@ -21,58 +115,91 @@ class GitLabScraper:
         'direction': 'https://about.gitlab.com/direction'
     }
     
-    def __init__(self, output_dir: str = 'data', max_depth: int = 3, max_pages: int = 100):
+    def __init__(self, output_dir: str = 'data', max_depth: int = 3, max_pages: int = 100,
+                 concurrency: int = 8, request_delay: float = 0.5,
+                 max_retries: int = 3, backoff_factor: float = 0.3, use_cache: bool = True):
         self.output_dir = output_dir
         self.max_depth = max_depth  # Maximum depth for recursive crawling
         self.max_pages = max_pages  # Maximum total pages to scrape
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        self.concurrency = concurrency  # Maximum requests in flight at once
+        self.request_delay = request_delay  # Pause held by each request slot after a fetch (politeness)
+        self.max_retries = max_retries  # Retries for connection errors, timeouts and _RETRY_STATUSES
+        self.backoff_factor = backoff_factor  # Retry n waits backoff_factor * 2**n seconds
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'Accept': 'text/html,application/xhtml+xml',
+            # Ask for compressed HTML; only advertise Brotli when it can be decoded
+            'Accept-Encoding': 'gzip, br' if brotli is not None else 'gzip'
+        }
+        self._semaphore = None  # Created inside the event loop by scrape_all
+        self._executor = None  # Thread pool for HTML parsing, created by scrape_all
         os.makedirs(output_dir, exist_ok=True)
         self.visited_urls = set()  # Track visited URLs to avoid duplicates
+        self._seen_signatures = set()  # SHA1 digests of page content already extracted
+        self._signatures_lock = threading.Lock()  # Pages are parsed in worker threads
         self.scraped_count = 0  # Track total pages scraped
         
+        # On-disk crawl cache: unchanged pages answer 304 and reuse their stored links/chunks
+        self._cache = None
+        if use_cache:
+            self._cache = sqlite3.connect(os.path.join(output_dir, 'crawl_cache.db'))
+            self._cache.row_factory = sqlite3.Row
+            self._cache.execute(_CACHE_SCHEMA)
+            if self._cache.execute('PRAGMA user_version').fetchone()[0] != EXTRACTOR_VERSION:
+                # Links don't depend on the extractor; chunks and content signatures do
+                self._cache.execute('UPDATE pages SET chunks = NULL, sha1 = NULL')
+                self._cache.execute(f'PRAGMA user_version = {EXTRACTOR_VERSION}')
+                self._cache.commit()
+        
     def clean_text(self, text: str) -> str:
         """Clean and normalize text content"""
         if not text:
             return ""
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
-        # Remove leading/trailing whitespace
-        text = text.strip()
-        return text
+        # Collapse whitespace and trim
+        return _WS_RE.sub(' ', text).strip()
+    
+    def _find_main_content(self, root: lxml.html.HtmlElement) -> lxml.html.HtmlElement:
+        """Find main content area (falls back to <body>, then the whole document)"""
+        for xpath in _MAIN_CONTENT_XPATHS:
+            matches = xpath(root)
+            if matches:
+                return matches[0]
+        return root
     
-    def extract_sections(self, soup: BeautifulSoup, url: str) -> List[Dict]:
+    def _content_signature(self, main_content: lxml.html.HtmlElement) -> bytes:
+        """SHA1 of the page's normalized text (digits dropped) for duplicate detection"""
+        canonical = _DIGITS_RE.sub('', self.clean_text(main_content.text_content()))
+        return hashlib.sha1(canonical.encode('utf-8')).digest()
+    
+    def _claim_signature(self, signature: bytes) -> bool:
+        """Record a content signature; False if another page already had it"""
+        with self._signatures_lock:
+            if signature in self._seen_signatures:
+                return False
+            self._seen_signatures.add(signature)
+        return True
+    
+    def extract_sections(self, root: lxml.html.HtmlElement, url: str) -> List[Dict]:
         """
         Extract content sections with metadata
         Returns chunks with: source_url, section_title, start_char, end_char, content
         """
         chunks = []
-        content_text = ""
-        
-        # Find main content area (adjust selectors based on GitLab's structure)
-        main_content = soup.find('main') or soup.find('article') or soup.find('div', class_=re.compile('content|main|article'))
-        
-        if not main_content:
-            main_content = soup.find('body')
+        main_content = self._find_main_content(root)
         
         # Extract all headings and content
         current_section_title = "Introduction"
         current_section_content = []
         char_offset = 0
         
-        for element in main_content.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'li', 'div']):
-            # Skip navigation, footer, header elements
-            if element.find_parent(['nav', 'header', 'footer', 'aside']):
-                continue
-                
-            text = self.clean_text(element.get_text())
+        # One XPath pass (evaluated in libxml2)
+        for element in _SECTION_XPATH(main_content):
+            text = self.clean_text(element.text_content())
             if not text or len(text) < 10:
                 continue
             
             # If it's a heading, save previous section and start new one
-            if element.name in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+            if element.tag in _HEADING_TAGS:
                 # Save previous section if it has content
                 if current_section_content:
                     section_text = ' '.join(current_section_content)
@@ -113,7 +240,7 @@ class GitLabScraper:
         
         # If no sections found, create one chunk from all content
         if not chunks:
-            all_text = self.clean_text(main_content.get_text())
+            all_text = self.clean_text(main_content.text_content())
             if len(all_text) > 50:
                 chunks.append({
                     'source_url': url,
@@ -125,30 +252,106 @@ class GitLabScraper:
         
         return chunks
     
-    def scrape_page(self, url: str) -> List[Dict]:
+    def _make_link_soup(self, content: bytes, encoding: Optional[str] = None) -> BeautifulSoup:
+        """Parse only the <a href> elements of a page with lxml (runs in the thread pool)"""
+        # Passing the HTTP charset skips BeautifulSoup's encoding detection
+        return BeautifulSoup(content, 'lxml', parse_only=_LINK_STRAINER, from_encoding=encoding)
+    
+    def _parse_page(self, content: bytes, encoding: Optional[str], url: str) -> Tuple[Optional[List[Dict]], bytes]:
+        """
+        Parse a fetched page and extract its chunks (CPU-bound part of scrape_page)
+        Returns (chunks, content signature); chunks is None for a duplicate page
+        """
+        # Page content goes straight to lxml.html; a parser per call keeps worker threads independent
+        parser = lxml.html.HTMLParser(encoding=encoding) if encoding else None
+        root = lxml.html.document_fromstring(content, parser=parser)
+        
+        # Remove script/style and boilerplate subtrees in a single XPath pass
+        for element in _STRIP_XPATH(root):
+            element.drop_tree()
+        
+        # Same content under another URL (or a date/counter variant): nothing new to extract
+        signature = self._content_signature(self._find_main_content(root))
+        if not self._claim_signature(signature):
+            return None, signature
+        
+        return self.extract_sections(root, url), signature
+    
+    def _cached_page(self, url: str) -> Optional[sqlite3.Row]:
+        """Crawl cache row for a URL (None if uncached or the cache is disabled)"""
+        if self._cache is None:
+            return None
+        return self._cache.execute('SELECT * FROM pages WHERE url = ?', (url,)).fetchone()
+    
+    def _conditional_headers(self, row: Optional[sqlite3.Row], column: str) -> Optional[Dict]:
+        """If-None-Match / If-Modified-Since headers, only when `column` has a cached value to fall back on"""
+        if row is None or row[column] is None:
+            return None
+        headers = {}
+        if row['etag']:
+            headers['If-None-Match'] = row['etag']
+        if row['last_modified']:
+            headers['If-Modified-Since'] = row['last_modified']
+        return headers or None
+    
+    async def _fetch(self, session: aiohttp.ClientSession, url: str,
+                     headers: Optional[Dict] = None) -> Tuple[Optional[bytes], Optional[str], Optional[str], Optional[str]]:
+        """
+        Fetch a page, holding one of the `concurrency` request slots
+        Returns (body, charset, etag, last_modified); body is None on 304 Not Modified
+        """
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                last_attempt = attempt == self.max_retries
+                try:
+                    async with session.get(url, headers=headers) as response:
+                        if last_attempt or response.status not in _RETRY_STATUSES:
+                            response.raise_for_status()
+                            content = None if response.status == 304 else await response.read()
+                            encoding = response.charset  # From Content-Type; None if the server didn't send one
+                            etag = response.headers.get('ETag')
+                            last_modified = response.headers.get('Last-Modified')
+                            break
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if last_attempt:
+                        raise
+                # Exponential backoff, still holding the slot so a struggling server sees less load
+                await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            await asyncio.sleep(self.request_delay)  # Rate limiting per slot
+        return content, encoding, etag, last_modified
+    
+    async def _run_in_executor(self, func, *args):
+        """Run a CPU-bound parsing step in the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+    
+    async def scrape_page(self, session: aiohttp.ClientSession, url: str, progress: str = "") -> List[Dict]:
         """Scrape a single page and return chunks with metadata"""
         try:
-            print(f"Scraping: {url}")
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
+            row = self._cached_page(url)
+            content, encoding, etag, last_modified = await self._fetch(
+                session, url, self._conditional_headers(row, 'chunks')
+            )
             
-            # Try lxml first, fallback to html.parser if not available
-            try:
-                soup = BeautifulSoup(response.content, 'lxml')
-            except:
-                soup = BeautifulSoup(response.content, 'html.parser')
+            if content is None:
+                # 304 Not Modified: reuse last run's chunks without parsing
+                chunks = loads(row['chunks']) if self._claim_signature(row['sha1']) else []
+                print(f"{progress}Unchanged: {url} ({len(chunks)} cached chunks)")
+                return chunks
             
-            # Remove script and style elements
-            for script in soup(["script", "style", "nav", "header", "footer"]):
-                script.decompose()
+            chunks, signature = await self._run_in_executor(self._parse_page, content, encoding, url)
+            if self._cache is not None:
+                # Duplicates store no chunks, so the next run fetches them in full again
+                self._cache.execute(_CACHE_PUT_CHUNKS, (
+                    url, etag, last_modified, signature,
+                    dumps(chunks).decode('utf-8') if chunks is not None else None
+                ))
+            print(f"{progress}Scraped: {url} ({len(chunks)} chunks)" if chunks else f"{progress}Skipped (no new content): {url}")
             
-            chunks = self.extract_sections(soup, url)
-            print(f"  Extracted {len(chunks)} chunks")
-            
-            return chunks
+            return chunks or []
             
         except Exception as e:
-            print(f"Error scraping {url}: {str(e)}")
+            print(f"{progress}Error scraping {url}: {str(e)}")
             return []
     
     def is_valid_url(self, url: str, base_domain: str) -> bool:
@@ -166,14 +369,8 @@ class GitLabScraper:
                     return False
             
             # Skip common non-content URLs
-            skip_patterns = [
-                '/search', '/login', '/logout', '/sign', '/api/', 
-                '.pdf', '.zip', '.jpg', '.png', '.gif', '.svg',
-                '#', 'mailto:', 'tel:', 'javascript:'
-            ]
-            for pattern in skip_patterns:
-                if pattern in url.lower():
-                    return False
+            if _SKIP_RE.search(url):
+                return False
             
             # Must be HTTP/HTTPS
             if not url.startswith(('http://', 'https://')):
@@ -184,8 +381,8 @@ class GitLabScraper:
             return False
     
     def extract_links(self, soup: BeautifulSoup, current_url: str, base_domain: str) -> List[str]:
-        """Extract all valid links from a page"""
-        links = []
+        """Extract all valid links from a page (deduplicated, in page order)"""
+        links = {}  # Insertion-ordered set
         base_url = self.BASE_URLS[base_domain]
         
         for link in soup.find_all('a', href=True):
@@ -202,68 +399,77 @@ class GitLabScraper:
             # Normalize URL (remove fragments, trailing slashes)
             full_url = full_url.split('#')[0].rstrip('/')
             
-            # Validate URL
-            if self.is_valid_url(full_url, base_domain):
-                if full_url not in self.visited_urls:
-                    links.append(full_url)
+            # Validate URL (already-visited links are filtered by the crawler)
+            if full_url not in links:
+                if self.is_valid_url(full_url, base_domain):
+                    links[full_url] = None
         
-        return links
+        return list(links)
+    
+    async def _discover_links(self, session: aiohttp.ClientSession, url: str,
+                              base_domain: str, depth: int) -> Optional[List[str]]:
+        """Fetch a page and return its links (None if the page could not be fetched)"""
+        try:
+            print(f"  [Depth {depth}] Discovering links from: {url}")
+            row = self._cached_page(url)
+            content, encoding, etag, last_modified = await self._fetch(
+                session, url, self._conditional_headers(row, 'links')
+            )
+            if content is None:
+                # 304 Not Modified: the page links to the same places as last run
+                return loads(row['links'])
+            
+            soup = await self._run_in_executor(self._make_link_soup, content, encoding)
+            links = self.extract_links(soup, url, base_domain)
+            if self._cache is not None:
+                self._cache.execute(_CACHE_PUT_LINKS, (url, etag, last_modified, dumps(links).decode('utf-8')))
+            return links
+        except Exception as e:
+            print(f"  Error discovering links from {url}: {str(e)}")
+            return None
     
-    def crawl_recursive(self, start_urls: List[str], base_domain: str, depth: int = 0) -> List[str]:
+    async def crawl_recursive(self, session: aiohttp.ClientSession, start_urls: List[str],
+                              base_domain: str, depth: int = 0) -> List[str]:
         """
-        Recursively crawl pages starting from start_urls
+        Crawl pages breadth-first starting from start_urls (one concurrent batch per depth level)
         Returns list of all URLs to scrape
         """
         if depth > self.max_depth or len(self.visited_urls) >= self.max_pages:
             return []
         
+        # This level's frontier: unvisited URLs, capped by the remaining page budget
+        frontier = [url for url in dict.fromkeys(start_urls) if url not in self.visited_urls]
+        frontier = frontier[:self.max_pages - len(self.visited_urls)]
+        
+        # Fetch the whole level concurrently
+        results = await asyncio.gather(
+            *(self._discover_links(session, url, base_domain, depth) for url in frontier)
+        )
+        
         urls_to_scrape = []
-        next_level_urls = []
+        next_level_urls = {}  # Insertion-ordered set: O(1) membership, deterministic frontier order
         
-        for url in start_urls:
-            if url in self.visited_urls:
+        for url, found_links in zip(frontier, results):
+            if found_links is None:
                 continue
             
-            if len(self.visited_urls) >= self.max_pages:
-                break
+            # Mark as visited (for discovery phase)
+            self.visited_urls.add(url)
+            urls_to_scrape.append(url)
             
-            try:
-                print(f"  [Depth {depth}] Discovering links from: {url}")
-                response = self.session.get(url, timeout=10)
-                response.raise_for_status()
-                
-                # Try lxml first, fallback to html.parser if not available
-                try:
-                    soup = BeautifulSoup(response.content, 'lxml')
-                except:
-                    soup = BeautifulSoup(response.content, 'html.parser')
-                
-                # Extract links from this page
-                found_links = self.extract_links(soup, url, base_domain)
-                
-                # Mark as visited (for discovery phase)
-                self.visited_urls.add(url)
-                urls_to_scrape.append(url)
-                
-                # Add new links for next level
-                for link in found_links:
-                    if link not in self.visited_urls and link not in next_level_urls:
-                        next_level_urls.append(link)
-                
-                time.sleep(0.5)  # Rate limiting
-                
-            except Exception as e:
-                print(f"  Error discovering links from {url}: {str(e)}")
-                continue
+            # Add new links for next level
+            for link in found_links:
+                if link not in self.visited_urls and link not in next_level_urls:
+                    next_level_urls[link] = None
         
-        # Recursively crawl next level
+        # Crawl next level
         if next_level_urls and depth < self.max_depth and len(self.visited_urls) < self.max_pages:
-            deeper_urls = self.crawl_recursive(next_level_urls, base_domain, depth + 1)
+            deeper_urls = await self.crawl_recursive(session, list(next_level_urls), base_domain, depth + 1)
             urls_to_scrape.extend(deeper_urls)
         
         return urls_to_scrape
     
-    def find_all_pages(self, base_domain: str = 'handbook') -> List[str]:
+    async def find_all_pages(self, session: aiohttp.ClientSession, base_domain: str = 'handbook') -> List[str]:
         """
         Find all pages to scrape by recursively following links
         base_domain: 'handbook' or 'direction'
@@ -278,58 +484,80 @@ class GitLabScraper:
         
         # Start with base URL
         start_url = self.BASE_URLS[base_domain]
-        all_urls = self.crawl_recursive([start_url], base_domain, depth=0)
+        all_urls = await self.crawl_recursive(session, [start_url], base_domain, depth=0)
         
         print(f"\nDiscovered {len(all_urls)} unique pages to scrape")
         return all_urls
     
-    def scrape_all(self):
-        """Scrape all handbook and direction pages recursively"""
-        all_chunks = []
-        
-        # Discover and scrape handbook pages
-        print("\n" + "=" * 60)
-        print("PHASE 1: Discovering Handbook Pages")
-        print("=" * 60)
-        handbook_urls = self.find_all_pages('handbook')
+    async def scrape_pages(self, session: aiohttp.ClientSession, urls: List[str], out) -> int:
+        """Scrape pages concurrently, writing chunks to `out` as JSON lines in the order of `urls`"""
+        tasks = [
+            asyncio.ensure_future(self.scrape_page(session, url, f"[{i}/{len(urls)}] "))
+            for i, url in enumerate(urls, 1)
+        ]
         
-        print("\n" + "=" * 60)
-        print("PHASE 2: Scraping Handbook Content")
-        print("=" * 60)
-        for i, url in enumerate(handbook_urls, 1):
-            print(f"[{i}/{len(handbook_urls)}] ", end="")
-            chunks = self.scrape_page(url)
-            all_chunks.extend(chunks)
-            time.sleep(0.8)  # Be respectful with rate limiting
-        
-        # Discover and scrape direction pages
-        print("\n" + "=" * 60)
-        print("PHASE 3: Discovering Direction Pages")
-        print("=" * 60)
-        direction_urls = self.find_all_pages('direction')
+        # Write each page as soon as it (and every page before it) is done, instead of collecting everything
+        chunk_count = 0
+        for task in tasks:
+            for chunk in await task:
+                out.write(dumps(chunk) + b'\n')
+                chunk_count += 1
+        return chunk_count
+    
+    def scrape_all(self) -> int:
+        """Scrape all handbook and direction pages recursively. Returns the number of chunks saved"""
+        return asyncio.run(self._scrape_all_async())
+    
+    async def _scrape_all_async(self) -> int:
+        """Async implementation of scrape_all (one shared HTTP session and parse pool)"""
+        # Chunks are streamed to a temp file and swapped in at the end, so a failed crawl keeps the old data
+        output_file = os.path.join(self.output_dir, 'gitlab_chunks.jsonl')
+        tmp_file = output_file + '.tmp'
+        chunk_count = 0
+        self._seen_signatures = set()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        # One pooled, keep-alive connector for the whole crawl (DNS cached across requests)
+        connector = aiohttp.TCPConnector(limit=20, limit_per_host=4, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=10)
         
-        print("\n" + "=" * 60)
-        print("PHASE 4: Scraping Direction Content")
-        print("=" * 60)
-        for i, url in enumerate(direction_urls, 1):
-            print(f"[{i}/{len(direction_urls)}] ", end="")
-            chunks = self.scrape_page(url)
-            all_chunks.extend(chunks)
-            time.sleep(0.8)
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, os.cpu_count() or 1)) as executor, \
+                open(tmp_file, 'wb') as out:
+            self._executor = executor
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers) as session:
+                # Discover and scrape handbook pages
+                print("\n" + "=" * 60)
+                print("PHASE 1: Discovering Handbook Pages")
+                print("=" * 60)
+                handbook_urls = await self.find_all_pages(session, 'handbook')
+                
+                print("\n" + "=" * 60)
+                print("PHASE 2: Scraping Handbook Content")
+                print("=" * 60)
+                chunk_count += await self.scrape_pages(session, handbook_urls, out)
+                
+                # Discover and scrape direction pages
+                print("\n" + "=" * 60)
+                print("PHASE 3: Discovering Direction Pages")
+                print("=" * 60)
+                direction_urls = await self.find_all_pages(session, 'direction')
+                
+                print("\n" + "=" * 60)
+                print("PHASE 4: Scraping Direction Content")
+                print("=" * 60)
+                chunk_count += await self.scrape_pages(session, direction_urls, out)
         
-        # Save all chunks
-        output_file = os.path.join(self.output_dir, 'gitlab_chunks.json')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(all_chunks, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, output_file)
+        if self._cache is not None:
+            self._cache.commit()  # Only after the output swap, so the cache never runs ahead of the data
         
         print(f"\n{'=' * 60}")
         print(f"Scraping complete!")
         print(f"   Total pages scraped: {len(handbook_urls) + len(direction_urls)}")
-        print(f"   Total chunks extracted: {len(all_chunks)}")
+        print(f"   Total chunks extracted: {chunk_count}")
         print(f"   Saved to: {output_file}")
         print(f"{'=' * 60}")
         
-        return all_chunks
+        return chunk_count
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+"""
+Semantic Response Cache
+Reuses answers for repeated or near-duplicate questions using embedding similarity
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    """Cache chatbot responses keyed on query embeddings (cosine similarity lookup)"""
+
+    def __init__(self, embed_fn: Callable[[str], List[float]], threshold: float = 0.95,
+                 max_size: int = 256, ttl: Optional[float] = None):
+        self.embed_fn = embed_fn
+        self.threshold = threshold  # Minimum cosine similarity for a cache hit
+        self.max_size = max_size
+        self.ttl = ttl  # Seconds before an entry expires (None = never)
+
+        self._embeddings: Optional[np.ndarray] = None  # (N, d) float32, L2-normalized rows
+        self._responses: List[Dict] = []
+        self._created: List[float] = []
+        self._last_used: List[float] = []  # For LRU eviction
+        self._lock = threading.Lock()  # Shared across Streamlit sessions
+
+    def embed(self, query: str) -> np.ndarray:
+        """Embed a query once so it can be used for both lookup and insertion"""
+        q = np.asarray(self.embed_fn(query), dtype=np.float32)
+        norm = np.linalg.norm(q)
+        return q / norm if norm > 0 else q
+
+    def lookup(self, q: np.ndarray) -> Optional[Dict]:
+        """Return the cached response for the most similar query, if similar enough"""
+        with self._lock:
+            if self._embeddings is None:
+                return None
+
+            now = time.monotonic()
+            if self.ttl is not None:
+                self._evict_expired(now)
+                if self._embeddings is None:
+                    return None
+
+            sims = self._embeddings @ q
+            best = int(sims.argmax())
+            if sims[best] < self.threshold:
+                return None
+
+            self._last_used[best] = now
+            return self._responses[best]
+
+    def add(self, q: np.ndarray, response: Dict):
+        """Cache a response for the given query embedding"""
+        with self._lock:
+            now = time.monotonic()
+            if len(self._responses) >= self.max_size:
+                self._remove(int(np.argmin(self._last_used)))
+
+            row = q.reshape(1, -1)
+            self._embeddings = row if self._embeddings is None else np.vstack([self._embeddings, row])
+            self._responses.append(response)
+            self._created.append(now)
+            self._last_used.append(now)
+
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._embeddings = None
+            self._responses = []
+            self._created = []
+            self._last_used = []
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def _evict_expired(self, now: float):
+        """Remove entries older than the TTL (caller holds the lock)"""
+        for idx in reversed(range(len(self._created))):
+            if now - self._created[idx] > self.ttl:
+                self._remove(idx)
+
+    def _remove(self, idx: int):
+        """Remove a single entry by index (caller holds the lock)"""
+        del self._responses[idx]
+        del self._created[idx]
+        del self._last_used[idx]
+        if self._responses:
+            self._embeddings = np.delete(self._embeddings, idx, axis=0)
+        else:
+            self._embeddings = None
@@ -4,7 +4,7 @@ Utility functions for the chatbot application
 
 import streamlit as st
 from typing import Dict, List
-import json
+from jsonio import dumps, loads
 
 
 def format_source_citation(source: Dict) -> str:
@@ -24,8 +24,8 @@ def format_source_citation(source: Dict) -> str:
 def save_conversation_history(history: List[Dict], filename: str = 'conversation_history.json'):
     """Save conversation history to file"""
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
+        with open(filename, 'wb') as f:
+            f.write(dumps(history, indent=True))
     except Exception as e:
         print(f"Error saving history: {e}")
 
@@ -33,8 +33,8 @@ def save_conversation_history(history: List[Dict], filename: str = 'conversation
 def load_conversation_history(filename: str = 'conversation_history.json') -> List[Dict]:
     """Load conversation history from file"""
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(filename, 'rb') as f:
+            return loads(f.read())
     except FileNotFoundError:
         return []
     except Exception as e:
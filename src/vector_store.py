@@ -4,53 +4,72 @@ Handles embeddings, token-based chunking, and similarity search for RAG
 Preserves custom metadata: source_url, section_title, start_char, end_char
 """
 
-import json
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
 import time
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
 from langchain_chroma import Chroma
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.embeddings import FastEmbedEmbeddings
 from langchain_core.documents import Document
+import numpy as np
 import tiktoken
 
-os.environ['TORCH_COMPILE_DISABLE'] = '1'
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+from jsonio import dumps, loads
+
+
+def _doc_id(text: str, source_url: str) -> str:
+    """Deterministic chunk id from its text and page, so re-runs can tell which chunks are stored"""
+    return hashlib.blake2b((text + source_url).encode('utf-8'), digest_size=16).hexdigest()
+
+
+# Embedding shards run concurrently; each ONNX Runtime call gets cpu_count // EMBED_WORKERS threads
+EMBED_WORKERS = 4
+
+# BGE-small vectors; HNSW graph degree for the FAISS query index
+EMBEDDING_DIM = 384
+HNSW_M = 32
+
+# Vectors sampled to train the 8-bit scalar quantizer (per-dimension value ranges)
+SQ_TRAIN_SAMPLE = 10000
 
 
 class VectorStore:
     """Manages vector embeddings and similarity search using LangChain"""
     
     def __init__(self, data_dir: str = 'data', persist_dir: str = 'chroma_db', 
-                 chunk_size: int = 300, chunk_overlap: int = 50):
+                 chunk_size: int = 300, chunk_overlap: int = 50, quantized: bool = True):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
         self.data_dir = data_dir
         self.persist_dir = persist_dir
+        self.chunk_size = chunk_size  # Tokens per chunk
+        self.chunk_overlap = chunk_overlap  # Tokens shared by consecutive chunks
+        self.quantized = quantized  # FAISS index stores int8 codes (4x smaller) instead of FP32 vectors
         os.makedirs(persist_dir, exist_ok=True)
         
         # Initialize embedding model
         # Using BGE-small-en-v1.5: 512 token limit, 384 dimensions, faster for real-time queries
-        print("Loading embedding model (BGE-small-en-v1.5) on CPU...")
+        # fastembed runs the int8-quantized ONNX export on ONNX Runtime (CPU, no torch);
+        # vectors are still 384-d and L2-normalized
+        print("Loading embedding model (BGE-small-en-v1.5, ONNX int8) on CPU...")
         start_time = time.time()
-        self.embedding_model = HuggingFaceEmbeddings(
+        self.embedding_model = FastEmbedEmbeddings(
             model_name='BAAI/bge-small-en-v1.5',
-            model_kwargs={
-                'device': 'cpu',  # Force CPU mode (no GPU needed)
-                'trust_remote_code': False  # Disable remote code execution
-            },
-            encode_kwargs={
-                'normalize_embeddings': True  # Normalize for better similarity
-            }
+            batch_size=64,  # Sentences per forward pass
+            threads=max(1, (os.cpu_count() or 1) // EMBED_WORKERS)  # Intra-op threads per call
         )
         load_time = time.time() - start_time
         print(f"Embedding model loaded successfully! (took {load_time:.2f}s)")
-        print(f"   Model: BGE-small-en-v1.5 | Dimensions: 384 | Context: 512 tokens")
-        
-        # Initialize text splitter for token-based chunking
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=self._count_tokens,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
+        print(f"   Model: BGE-small-en-v1.5 (ONNX) | Dimensions: 384 | Context: 512 tokens")
+        
+        # Tokenizer used for token-window chunking (loaded once)
+        self._encoding = tiktoken.get_encoding("cl100k_base")
         
         # Initialize ChromaDB with LangChain
         self.vector_store = Chroma(
@@ -59,22 +78,33 @@ class VectorStore:
             collection_name="gitlab_handbook"
         )
         self._collection = self.vector_store._collection  # For backward compatibility
-    
-    def _count_tokens(self, text: str) -> int:
-        """Count tokens using tiktoken"""
-        encoding = tiktoken.get_encoding("cl100k_base")
-        return len(encoding.encode(text))
+        
+        # In-memory FAISS index for queries (optional; built in initialize(), None = search Chroma)
+        self._faiss_index = None
+        self._faiss_docs: List[Dict] = []  # Formatted result per FAISS row (distance filled in per query)
     
     def load_chunks(self, file_path: Optional[str] = None) -> List[Dict]:
-        """Load chunks from JSON file"""
+        """Load chunks from the scraper's JSONL file (or a legacy JSON array file)"""
         if file_path is None:
-            file_path = os.path.join(self.data_dir, 'gitlab_chunks.json')
+            file_path = os.path.join(self.data_dir, 'gitlab_chunks.jsonl')
+            if not os.path.exists(file_path):
+                file_path = os.path.join(self.data_dir, 'gitlab_chunks.json')
         
         if not os.path.exists(file_path):
             return []
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        if file_path.endswith('.jsonl'):
+            return list(self._iter_jsonl(file_path))
+        
+        with open(file_path, 'rb') as f:
+            return loads(f.read())
+    
+    def _iter_jsonl(self, file_path: str) -> Iterator[Dict]:
+        """Yield one chunk per line of a JSONL file"""
+        with open(file_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield loads(line)
     
     def _create_langchain_documents(self, chunks: List[Dict]) -> List[Document]:
         """Convert custom chunks to LangChain Documents with metadata"""
@@ -96,41 +126,52 @@ class VectorStore:
         
         return documents
     
+    def _token_windows(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Split text into windows of chunk_size tokens overlapping by chunk_overlap tokens
+        Returns (start_char, end_char) spans into text; the text is tokenized once
+        """
+        tokens = self._encoding.encode(text)
+        if not tokens:
+            return []
+        
+        # Character offset of every token in the decoded text (equal to text for valid UTF-8)
+        decoded, offsets = self._encoding.decode_with_offsets(tokens)
+        step = self.chunk_size - self.chunk_overlap
+        
+        windows = []
+        for i in range(0, len(tokens), step):
+            end = i + self.chunk_size
+            windows.append((offsets[i], offsets[end] if end < len(tokens) else len(decoded)))
+            if end >= len(tokens):
+                break
+        return windows
+    
     def _split_with_metadata_preservation(self, documents: List[Document]) -> List[Document]:
         """Split documents while preserving and updating metadata"""
         split_docs = []
         
         for doc in documents:
-            # Split the content
-            splits = self.text_splitter.split_text(doc.page_content)
+            content = doc.page_content
+            windows = self._token_windows(content)
             
-            # Calculate character offsets for each split
-            current_char = doc.metadata['start_char']
-            
-            for i, split_text in enumerate(splits):
-                split_length = len(split_text)
-                split_start = current_char
-                split_end = current_char + split_length
-                
-                # Create new document with updated metadata
+            for i, (start, end) in enumerate(windows):
+                # Create new document with updated metadata (offsets relative to the source page)
                 split_doc = Document(
-                    page_content=split_text,
+                    page_content=content[start:end],
                     metadata={
                         'source_url': doc.metadata['source_url'],
                         'section_title': doc.metadata['section_title'],
-                        'start_char': split_start,
-                        'end_char': split_end,
+                        'start_char': doc.metadata['start_char'] + start,
+                        'end_char': doc.metadata['start_char'] + end,
                         'chunk_index': i,
-                        'total_chunks': len(splits),
+                        'total_chunks': len(windows),
                         'original_start': doc.metadata['start_char'],
-                        'original_end': doc.metadata['end_char']
+                        'original_end': doc.metadata['end_char'],
+                        'doc_id': _doc_id(content[start:end], doc.metadata['source_url'])
                     }
                 )
                 split_docs.append(split_doc)
-                
-                # Update for next split (account for overlap)
-                overlap_chars = self.text_splitter._chunk_overlap
-                current_char = split_end - overlap_chars
         
         return split_docs
     
@@ -149,7 +190,7 @@ class VectorStore:
         
         # Apply token-based chunking if requested
         if apply_token_chunking:
-            print("    Applying token-based chunking (~300 tokens with 50 overlap)...")
+            print(f"    Applying token-based chunking ({self.chunk_size} tokens with {self.chunk_overlap} overlap)...")
             chunk_start = time.time()
             documents = self._split_with_metadata_preservation(documents)
             chunk_time = time.time() - chunk_start
@@ -157,44 +198,97 @@ class VectorStore:
         else:
             print(f"  Using original chunks (no splitting)")
         
-        # Check existing documents
+        # Chunks are stored under a content-hash id (unsplit chunks get theirs here)
+        for doc in documents:
+            if 'doc_id' not in doc.metadata:
+                doc.metadata['doc_id'] = _doc_id(doc.page_content, doc.metadata['source_url'])
+        
+        # Check existing documents (ids only)
         try:
-            existing_count = self.vector_store._collection.count()
+            existing_ids = set(self.vector_store._collection.get(include=[])['ids'])
         except:
-            existing_count = 0
+            existing_ids = set()
         
-        # Skip embedding creation if embeddings already exist
-        if existing_count > 0:
-            print(f"   Found {existing_count:,} existing documents in vector store")
+        # Stores built before content-hash ids can't be diffed against the data, so keep them as they are
+        legacy_store = False
+        if existing_ids:
+            probe = self.vector_store._collection.get(limit=1, include=['metadatas'])
+            legacy_store = 'doc_id' not in (probe['metadatas'][0] or {})
+        if legacy_store:
+            print(f"   Found {len(existing_ids):,} existing documents in vector store")
             print(f"   Skipping embedding creation (embeddings already exist)")
             print(f"   To recreate embeddings, delete the 'chroma_db' folder and reinitialize")
             total_time = time.time() - start_time
             print(f"\nUsing existing embeddings!")
-            print(f"  Total documents in vector store: {existing_count:,}")
+            print(f"  Total documents in vector store: {len(existing_ids):,}")
             print(f"  Total time: {total_time:.2f}s (no embedding needed)\n")
             return
         
-        # Add to vector store with progress logging (only if no existing embeddings)
+        # The data file is the source of truth: drop stored chunks it no longer contains (edited or
+        # removed pages). The FAISS index sees the changed id set and is rebuilt
+        stale_ids = list(existing_ids - {doc.metadata['doc_id'] for doc in documents})
+        if stale_ids:
+            print(f"   Removing {len(stale_ids):,} chunks no longer in the data file...")
+            for i in range(0, len(stale_ids), 1024):
+                self.vector_store._collection.delete(ids=stale_ids[i:i + 1024])
+            existing_ids.difference_update(stale_ids)
+        
+        # Only embed chunks that aren't stored yet (also drops repeats within this run)
+        new_docs = {}
+        for doc in documents:
+            doc_id = doc.metadata['doc_id']
+            if doc_id not in existing_ids and doc_id not in new_docs:
+                new_docs[doc_id] = doc
+        documents = list(new_docs.values())
+        
+        if not documents:
+            total_time = time.time() - start_time
+            print(f"\nVector store is up to date!")
+            print(f"  Total documents in vector store: {len(existing_ids):,}")
+            print(f"  Total time: {total_time:.2f}s (no embedding needed)\n")
+            return
+        
+        # Add to vector store with progress logging (new chunks only)
+        if existing_ids:
+            print(f"   Found {len(existing_ids):,} existing documents in vector store")
         print(f"\nCreating embeddings for {len(documents):,} documents...")
         print("   (This may take a few minutes on CPU - please wait...)")
         embed_start = time.time()
         
-        # Process in batches for progress updates
-        batch_size = 100
+        # Embed at the model level (64-sentence forward passes) and write straight to the collection;
+        # slices only bound memory and drive the progress updates
+        batch_size = 1024
         total_batches = (len(documents) + batch_size - 1) // batch_size
         
-        for i in range(0, len(documents), batch_size):
-            batch = documents[i:i + batch_size]
-            batch_num = (i // batch_size) + 1
-            self.vector_store.add_documents(batch)
-            
-            # Progress update every batch
-            if batch_num % 10 == 0 or batch_num == total_batches:
+        # BGE-small's small matmuls can't saturate every core from one call, so each slice is
+        # sharded across EMBED_WORKERS concurrent calls (ONNX Runtime releases the GIL)
+        with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+            for i in range(0, len(documents), batch_size):
+                batch = documents[i:i + batch_size]
+                batch_num = (i // batch_size) + 1
+                texts = [doc.page_content for doc in batch]
+                
+                shard_size = -(-len(texts) // EMBED_WORKERS)  # Ceiling division
+                shards = [texts[j:j + shard_size] for j in range(0, len(texts), shard_size)]
+                embeddings = [
+                    embedding
+                    for shard_embeddings in executor.map(self.embedding_model.embed_documents, shards)
+                    for embedding in shard_embeddings
+                ]
+                
+                self.vector_store._collection.add(
+                    ids=[doc.metadata['doc_id'] for doc in batch],
+                    embeddings=embeddings,
+                    metadatas=[doc.metadata for doc in batch],
+                    documents=texts
+                )
+                
+                # Progress update every batch
                 elapsed = time.time() - embed_start
                 rate = batch_num / elapsed if elapsed > 0 else 0
                 remaining = (total_batches - batch_num) / rate if rate > 0 else 0
                 print(f"   Progress: {batch_num:,}/{total_batches:,} batches "
-                      f"({batch_num * batch_size:,}/{len(documents):,} docs) | "
+                      f"({min(batch_num * batch_size, len(documents)):,}/{len(documents):,} docs) | "
                       f"ETA: {remaining/60:.1f}min")
         
         # Persist to disk (ChromaDB with persist_directory auto-persists)
@@ -217,8 +311,102 @@ class VectorStore:
         print(f"  Total time: {total_time/60:.2f}min (embedding: {embed_time/60:.2f}min)")
         print(f"  Average speed: {len(documents)/embed_time:.1f} docs/sec\n")
     
-    def search(self, query: str, n_results: int = 5) -> List[Dict]:
-        """Search for similar chunks with custom metadata"""
+    def _format_result(self, content: str, metadata: Optional[Dict], distance: Optional[float] = None) -> Dict:
+        """Format a stored chunk with custom metadata"""
+        metadata = metadata or {}
+        result = {
+            'content': content,
+            'source_url': metadata.get('source_url', ''),
+            'section_title': metadata.get('section_title', ''),
+            'start_char': int(metadata.get('start_char', 0)),
+            'end_char': int(metadata.get('end_char', 0))
+        }
+        if distance is not None:
+            result['distance'] = float(distance)
+        return result
+    
+    def _load_or_build_faiss_index(self):
+        """Load the persisted FAISS HNSW index, or build it from the embeddings stored in Chroma"""
+        self._faiss_index = None
+        self._faiss_docs = []
+        if faiss is None:
+            return
+        try:
+            count = self.vector_store._collection.count()
+        except:
+            count = 0
+        if count == 0:
+            return
+        
+        index_name = 'faiss_hnsw_sq8' if self.quantized else 'faiss_hnsw'
+        index_path = os.path.join(self.persist_dir, f'{index_name}.index')
+        ids_path = os.path.join(self.persist_dir, f'{index_name}_ids.json')
+        
+        # Row i of the index is chunk ids[i]; keep each chunk's formatted result in memory
+        stored = self.vector_store._collection.get(include=['documents', 'metadatas'])
+        by_id = {
+            chunk_id: self._format_result(content, metadata)
+            for chunk_id, content, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])
+        }
+        
+        index = None
+        if os.path.exists(index_path) and os.path.exists(ids_path):
+            index = faiss.read_index(index_path)
+            with open(ids_path, 'rb') as f:
+                ids = loads(f.read())
+            if index.ntotal != len(ids) or set(ids) != by_id.keys():
+                index = None  # Collection changed since the index was saved
+        
+        if index is None:
+            print("Building FAISS HNSW index from stored embeddings...")
+            start_time = time.time()
+            stored = self.vector_store._collection.get(include=['embeddings'])
+            ids = stored['ids']
+            embeddings = np.asarray(stored['embeddings'], dtype=np.float32)
+            # Embeddings are L2-normalized, so inner product == cosine similarity
+            if self.quantized:
+                # 8-bit scalar quantization: 384 B per vector instead of 1.5 KB; full-precision
+                # vectors stay in Chroma
+                index = faiss.IndexHNSWSQ(
+                    EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+                )
+                index.train(embeddings[:SQ_TRAIN_SAMPLE])
+            else:
+                index = faiss.IndexHNSWFlat(EMBEDDING_DIM, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 80
+            index.add(embeddings)
+            faiss.write_index(index, index_path)
+            with open(ids_path, 'wb') as f:
+                f.write(dumps(ids))
+            print(f"   FAISS index ready: {index.ntotal:,} vectors (took {time.time() - start_time:.2f}s)")
+        
+        index.hnsw.efSearch = 64
+        self._faiss_docs = [by_id[chunk_id] for chunk_id in ids]
+        self._faiss_index = index
+    
+    def _faiss_search(self, query_embeddings, n_results: int) -> List[List[Dict]]:
+        """Search the FAISS index for a batch of query embeddings"""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        similarities, rows = self._faiss_index.search(queries, min(n_results, self._faiss_index.ntotal))
+        
+        # Report Chroma's squared-L2 distance so thresholds downstream are unchanged:
+        # for unit vectors |a - b|^2 = 2 - 2 * cos(a, b)
+        return [
+            [
+                {**self._faiss_docs[row], 'distance': max(0.0, float(2.0 - 2.0 * similarity))}
+                for similarity, row in zip(query_similarities, query_rows)
+                if row >= 0
+            ]
+            for query_similarities, query_rows in zip(similarities, rows)
+        ]
+    
+    def search(self, query: str, n_results: int = 5, query_embedding: Optional[List[float]] = None) -> List[Dict]:
+        """Search for similar chunks with custom metadata (pass query_embedding if already computed)"""
+        if self._faiss_index is not None:
+            if query_embedding is None:
+                query_embedding = self.embedding_model.embed_query(query)
+            return self._faiss_search([query_embedding], n_results)[0]
+        
         try:
             count = self.vector_store._collection.count()
         except:
@@ -227,26 +415,54 @@ class VectorStore:
             return []
         
         # Use LangChain's similarity search
-        results = self.vector_store.similarity_search_with_score(
-            query, 
-            k=n_results
+        if query_embedding is not None:
+            results = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+                np.asarray(query_embedding, dtype=np.float32).tolist(),
+                k=n_results
+            )
+        else:
+            results = self.vector_store.similarity_search_with_score(
+                query, 
+                k=n_results
+            )
+        
+        # Format results with custom metadata (LangChain returns distance as score)
+        return [self._format_result(doc.page_content, doc.metadata, score) for doc, score in results]
+    
+    def batch_search(self, queries: List[str], n_results: int = 5) -> List[List[Dict]]:
+        """Search several queries at once (one batched embedding pass + one index query)"""
+        if not queries:
+            return []
+        if self._faiss_index is not None:
+            return self._faiss_search(self.embedding_model.embed_documents(list(queries)), n_results)
+        
+        try:
+            count = self.vector_store._collection.count()
+        except:
+            count = 0
+        if count == 0:
+            return [[] for _ in queries]
+        
+        embeddings = self.embedding_model.embed_documents(list(queries))
+        results = self.vector_store._collection.query(
+            query_embeddings=embeddings,
+            n_results=n_results,
+            include=['documents', 'metadatas', 'distances']
         )
         
-        # Format results with custom metadata
-        formatted_results = []
-        for doc, score in results:
-            metadata = doc.metadata
-            formatted_results.append({
-                'content': doc.page_content,
-                'source_url': metadata.get('source_url', ''),
-                'section_title': metadata.get('section_title', ''),
-                'start_char': int(metadata.get('start_char', 0)),
-                'end_char': int(metadata.get('end_char', 0)),
-                'distance': float(score)  # LangChain returns distance as score
-            })
-        
-        return formatted_results
+        # Format results with custom metadata (one list per query)
+        return [
+            [
+                self._format_result(content, metadata, distance)
+                for content, metadata, distance in zip(documents, metadatas, distances)
+            ]
+            for documents, metadatas, distances in zip(results['documents'], results['metadatas'], results['distances'])
+        ]
     
+    def embed(self, text: str) -> List[float]:
+        """Embed a single query with the same model used for the index"""
+        return self.embedding_model.embed_query(text)
+
     def initialize(self, apply_token_chunking: bool = True):
         """Initialize vector store with data"""
         print("\n" + "="*60)
@@ -254,8 +470,9 @@ class VectorStore:
         print("="*60)
         chunks = self.load_chunks()
         if chunks:
-            print(f"Loaded {len(chunks):,} chunks from JSON file")
+            print(f"Loaded {len(chunks):,} chunks from data file")
             self.add_chunks(chunks, apply_token_chunking=apply_token_chunking)
+            self._load_or_build_faiss_index()
             print("="*60)
             print("VECTOR STORE INITIALIZATION COMPLETE!")
             print("="*60 + "\n")